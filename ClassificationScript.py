@@ -1,9 +1,9 @@
-import pandas as pd
 import os
+from naccMetadata import load_nacc_metadata, partition_nacc_csv
+from concurrentWriter import make_dirs, write_files
 
 # Load the original CSV file
 csv_path = 'commercial_nacc65a.csv'  # Update this path
-df = pd.read_csv(csv_path)
 
 # Map CDRGLOB values to categories
 alzheimers_category = {
@@ -14,35 +14,64 @@ alzheimers_category = {
     3: 'Severe'
 }
 
-# Add a column with mapped categories
-df['AlzheimerClassification'] = df['CDRGLOB'].map(alzheimers_category)
-
 # Define the base output directory
 output_base_dir = 'Categorization'  # Update this path
+output_format = 'txt'  # 'txt' (one file per patient), 'jsonl' or 'parquet' (one file per year)
+write_in_flight = 64  # Concurrent file creates/writes for the 'txt' format
+memory_budget = None  # e.g. 512 * 1024 * 1024 to stream the CSV one year at a time within that many bytes
 if not os.path.exists(output_base_dir):
     os.mkdir(output_base_dir)
 
-# Group the data by year and process each year separately
-for year, group in df.groupby('VISITYR'):
-    # Create a folder for the year
-    year_folder = os.path.join(output_base_dir, str(year))
-    if not os.path.exists(year_folder):
-        os.mkdir(year_folder)
-
-    # Group by NACCID for this year and write to separate files
-    for naccid, patient_group in group.groupby('NACCID'):
-        # Combine the diagnosis information for this patient
-        diagnoses = [
-            f"{row['VISITYR']} - {row['AlzheimerClassification']}"
-            for _, row in patient_group.iterrows()
-        ]
-
-        # Create a text file for this patient
-        patient_file_path = os.path.join(year_folder, f"{naccid}.txt")
-        with open(patient_file_path, 'w') as file:
-            file.write(f"Patient ID: {naccid}\n")
-            file.write("Diagnoses:\n")
-            for diagnosis in diagnoses:
-                file.write(f"- {diagnosis}\n")
+
+def build_reports(df):
+    """One report per patient per year, diagnoses in visit order"""
+    # Add a column with mapped categories
+    df = df.assign(AlzheimerClassification=df['CDRGLOB'].map(alzheimers_category))
+
+    # Build every patient's diagnosis lines in one vectorized pass, keeping visit order
+    df = df.sort_values(['VISITYR', 'NACCID'], kind='stable')
+    # map(str) rather than astype(str), which keeps NaN as missing under pandas 3 ("nan" as before)
+    df['Diagnosis'] = ("- " + df['VISITYR'].astype(object).map(str) + " - "
+                       + df['AlzheimerClassification'].astype(object).map(str))
+
+    reports = (
+        df.groupby(['VISITYR', 'NACCID'], observed=True, sort=False)['Diagnosis']
+        .agg("\n".join)
+        .reset_index()
+    )
+    reports['NACCID'] = reports['NACCID'].astype(str)
+    reports['Report'] = "Patient ID: " + reports['NACCID'] + "\nDiagnoses:\n" + reports['Diagnosis'] + "\n"
+    return reports
+
+
+def write_reports(reports):
+    """Write the reports in output_format"""
+    if output_format == 'txt':
+        # Create the year folders once, then keep many patient-file writes in flight at a time
+        reports['Path'] = (
+            os.path.join(output_base_dir, "") + reports['VISITYR'].astype(str) + os.sep + reports['NACCID'] + ".txt"
+        )
+        make_dirs((os.path.join(output_base_dir, str(year)) for year in reports['VISITYR'].unique()),
+                  in_flight=write_in_flight)
+        write_files(zip(reports['Path'], reports['Report']), in_flight=write_in_flight)
+    else:
+        # One consolidated file per year instead of thousands of small text files
+        for year, year_reports in reports.groupby('VISITYR', sort=False):
+            year_reports = year_reports[['NACCID', 'VISITYR', 'Report']]
+            year_path = os.path.join(output_base_dir, f"{year}.{output_format}")
+            if output_format == 'jsonl':
+                year_reports.to_json(year_path, orient='records', lines=True)
+            elif output_format == 'parquet':
+                year_reports.to_parquet(year_path, index=False)
+            else:
+                raise ValueError(f"Unknown output format: {output_format}")
+
+
+if memory_budget is None:
+    write_reports(build_reports(load_nacc_metadata(csv_path)))
+else:
+    # Reports never span years, so each year can be built and written on its own
+    for year, year_df in partition_nacc_csv(csv_path, key='VISITYR', memory_budget=memory_budget):
+        write_reports(build_reports(year_df))
 
 print(f"Data has been written to folders in {output_base_dir}")
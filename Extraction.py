@@ -2,7 +2,41 @@ import os
 import zipfile
 import shutil
 import re
+import stat
+import uuid
 import hashlib
+import tempfile
+import zlib
+import csv
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from instrumentation import stage, count
+from filePlacement import place_file, remove_file
+
+# Inner zips that are compressed inside the outer archive are spooled to memory
+# (and to a temp file beyond that) so they can be seeked cheaply. This is the total
+# across streaming workers: each one spools up to SPOOL_LIMIT // workers
+SPOOL_LIMIT = 256 * 1024 * 1024
+COPY_BUFFER = 1024 * 1024
+
+# Members up to this size are read in one call and written with a single write();
+# larger ones are streamed through COPY_BUFFER
+SMALL_MEMBER_LIMIT = 4 * 1024 * 1024
+# Small-member writes overlap with decompression on a thread pool, holding at most
+# WRITE_QUEUE_LIMIT bytes of decompressed data in flight
+WRITE_WORKERS = 8
+WRITE_QUEUE_LIMIT = 64 * 1024 * 1024
+
+# One console line per extracted zip; progress is otherwise reported by instrumentation
+VERBOSE = False
+
+# Verify mode: extra attempts for an inner zip that fails its CRC check before quarantining it
+VERIFY_RETRIES = 2
+REPORT_FIELDS = ['zip', 'member', 'output', 'size', 'crc', 'status', 'attempt']
+REPORT_NAME = "extraction_report.csv"
+
+# Outer archive handle and in-memory spool size, set once per worker process
+_worker_main_zip = None
+_worker_spool_limit = SPOOL_LIMIT
 
 
 def extract_nacc_id(name):
@@ -32,65 +66,466 @@ def unzip_file(zip_path, extract_to):
         print(f"❌ Failed to unzip {zip_path}: {e}")
 
 
-def safe_extract_zip_to_naccid(zip_path, extract_root):
+def name_key(filename):
+    """Key for `reserved` sets: names differing only in case are one file on Windows/SMB"""
+    return filename.lower()
+
+
+def plan_output_names(members, folder_naccid, reserved=None):
+    """Map each member to a stable output filename without touching the disk
+
+    `reserved` holds the name_key of names already taken and is updated in place.
+    """
+    reserved = reserved if reserved is not None else set()
+    plan = []
+
+    # Sorting by member name keeps the plan independent of archive order
+    for member in sorted(members, key=lambda m: m.filename):
+        # Try to extract NACC ID from filename or fallback to folder
+        nacc_id = extract_nacc_id(member.filename) or folder_naccid
+        ext = os.path.splitext(member.filename)[1]
+        filename = f"{nacc_id}{ext}"
+
+        # Avoid overwriting with hash if name repeats
+        if name_key(filename) in reserved:
+            digest = hashlib.md5(member.filename.encode()).hexdigest()
+            hash_len = 6
+            filename = f"{nacc_id}_{digest[:hash_len]}{ext}"
+            while name_key(filename) in reserved and hash_len < len(digest):
+                hash_len += 2
+                filename = f"{nacc_id}_{digest[:hash_len]}{ext}"
+
+        reserved.add(name_key(filename))
+        plan.append((member, filename))
+    return plan
+
+
+def open_new(target_path):
+    """Open target_path as a new file; an existing output may be a hardlink to a store blob"""
+    if os.path.lexists(target_path):
+        remove_file(target_path)
+    return open(target_path, "wb")
+
+
+def write_bytes(target_path, data):
+    with open_new(target_path) as target:
+        target.write(data)
+    return len(data)
+
+
+def copy_member(zip_ref, member, target_path):
+    """Stream a large member to disk through a big buffer"""
+    with zip_ref.open(member) as source, open_new(target_path) as target:
+        shutil.copyfileobj(source, target, COPY_BUFFER)
+
+
+def copy_member_verified(zip_ref, member, target_path):
+    """Copy one member while computing its CRC-32 on the fly; returns (size, crc)"""
+    if member.file_size <= SMALL_MEMBER_LIMIT:
+        data = zip_ref.read(member)
+        write_bytes(target_path, data)
+        return len(data), zlib.crc32(data)
+
+    size = crc = 0
+    with zip_ref.open(member) as source, open_new(target_path) as target:
+        for chunk in iter(lambda: source.read(COPY_BUFFER), b''):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            target.write(chunk)
+    return size, crc
+
+
+def blob_path(store, digest):
+    return os.path.join(store, digest[:2], digest)
+
+
+def _open_blob_tmp(store):
+    """Create a uniquely named temp file in the store; returns (path, open file)"""
+    tmp_path = os.path.join(store, f".tmp_{uuid.uuid4().hex}")
+    return tmp_path, open(tmp_path, "xb")
+
+
+def _add_blob(store, digest, tmp_path):
+    """Move a finished temp file into the store unless that content is already there; returns its path"""
+    path = blob_path(store, digest)
+    if os.path.exists(path):
+        remove_file(tmp_path)
+        return path, False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Blobs are shared by every output linked to them, so publish them read-only
+    # (the umask-derived mode open() gave the temp file, minus the write bits)
+    os.chmod(tmp_path, stat.S_IMODE(os.stat(tmp_path).st_mode) & ~0o222)
     try:
-        zip_name = os.path.basename(zip_path)
+        # Atomic, so a concurrent writer of the same content just replaces an identical blob
+        os.replace(tmp_path, path)
+    except PermissionError:
+        # Windows won't replace a read-only blob another worker just published
+        if not os.path.exists(path):
+            raise
+        remove_file(tmp_path)
+        return path, False
+    return path, True
+
+
+def store_bytes(store, data, target_path):
+    """Hardlink target_path to the blob holding data, writing the blob only if it is new; returns bytes written"""
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    written = 0
+    if not os.path.exists(blob_path(store, digest)):
+        tmp_path, target = _open_blob_tmp(store)
+        with target:
+            target.write(data)
+        if _add_blob(store, digest, tmp_path)[1]:
+            written = len(data)
+    place_file(blob_path(store, digest), target_path, 'hardlink')
+    return written
+
+
+def store_member(zip_ref, member, target_path, store):
+    """Extract one member through the content store, hashing it as it streams; returns (size, crc, bytes written)"""
+    if member.file_size <= SMALL_MEMBER_LIMIT:
+        data = zip_ref.read(member)
+        return len(data), zlib.crc32(data), store_bytes(store, data, target_path)
+
+    digest = hashlib.blake2b(digest_size=16)
+    size = crc = 0
+    tmp_path, target = _open_blob_tmp(store)
+    try:
+        with zip_ref.open(member) as source, target:
+            for chunk in iter(lambda: source.read(COPY_BUFFER), b''):
+                digest.update(chunk)
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                target.write(chunk)
+        path, added = _add_blob(store, digest.hexdigest(), tmp_path)
+    finally:
+        if os.path.exists(tmp_path):
+            remove_file(tmp_path)
+    place_file(path, target_path, 'hardlink')
+    return size, crc, size if added else 0
+
+
+def safe_extract_zip_to_naccid(zip_path, extract_root, zip_name=None, reserved=None, dry_run=False,
+                               report=None, store=None):
+    """Extract a per-patient zip (path or open file object) into its NACCID folder; returns counters
+
+    When a report list is given, every member is CRC-checked as it streams and its
+    status is appended to the list; members that fail are removed again.
+    With a store folder, identical members are kept once there and hardlinked.
+    """
+    counters = {'items': 1, 'files': 0, 'bytes_read': 0, 'bytes_written': 0, 'errors': 0}
+    try:
+        zip_name = zip_name or os.path.basename(zip_path)
         folder_naccid = extract_nacc_id(zip_name)
         if not folder_naccid:
             print(f"⚠️ Skipped (no NACC ID in zip name): {zip_name}")
-            return
+            return counters
 
         extract_path = long_path(os.path.join(extract_root, folder_naccid))
-        os.makedirs(os.path.dirname(extract_path), exist_ok=True)
 
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            for member in zip_ref.infolist():
-                if member.is_dir():
-                    continue
+            members = [member for member in zip_ref.infolist() if not member.is_dir()]
+            plan = plan_output_names(members, folder_naccid, reserved)
 
-                # Try to extract NACC ID from filename or fallback to folder
-                nacc_id = extract_nacc_id(member.filename) or folder_naccid
-                ext = os.path.splitext(member.filename)[1]
-                filename = f"{nacc_id}{ext}"
+            if dry_run:
+                for member, filename in plan:
+                    print(f"📝 {zip_name}:{member.filename} ➜ {os.path.join(extract_path, filename)}")
+                return counters
 
-                safe_path = long_path(os.path.join(extract_path, filename))
+            # Every member lands directly in the NACCID folder, so create it once
+            os.makedirs(extract_path, exist_ok=True)
+            if store is not None:
+                os.makedirs(store, exist_ok=True)
+            with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as writer:
+                pending, pending_bytes = [], 0
+                for member, filename in plan:
+                    safe_path = os.path.join(extract_path, filename)
+                    written = member.file_size
+                    if report is not None:
+                        status, written = verify_member(zip_ref, member, safe_path, zip_name, report, store)
+                        if status != 'ok':
+                            counters['errors'] += 1
+                            continue
+                    elif member.file_size <= SMALL_MEMBER_LIMIT:
+                        # Decompress here, write on the pool while the next member decompresses;
+                        # the pool reports the bytes it actually wrote
+                        data = zip_ref.read(member)
+                        if store is None:
+                            pending.append(writer.submit(write_bytes, safe_path, data))
+                        else:
+                            pending.append(writer.submit(store_bytes, store, data, safe_path))
+                        pending_bytes += len(data)
+                        written = 0
+                        if pending_bytes >= WRITE_QUEUE_LIMIT:
+                            counters['bytes_written'] += sum(future.result() for future in pending)
+                            pending, pending_bytes = [], 0
+                    elif store is None:
+                        copy_member(zip_ref, member, safe_path)
+                    else:
+                        written = store_member(zip_ref, member, safe_path, store)[2]
+                    counters['files'] += 1
+                    counters['bytes_read'] += member.compress_size
+                    counters['bytes_written'] += written
+                counters['bytes_written'] += sum(future.result() for future in pending)
 
-                # Avoid overwriting with hash if name repeats
-                if os.path.exists(safe_path):
-                    short_hash = hashlib.md5(member.filename.encode()).hexdigest()[:6]
-                    filename = f"{nacc_id}_{short_hash}{ext}"
-                    safe_path = long_path(os.path.join(extract_path, filename))
+        if VERBOSE:
+            print(f"✅ Clean-extracted: {zip_name} ➜ {extract_path}")
+    except Exception as e:
+        counters['errors'] += 1
+        print(f"❌ Failed to extract {zip_name or zip_path}: {e}")
+    return counters
 
-                os.makedirs(os.path.dirname(safe_path), exist_ok=True)
-                with zip_ref.open(member) as source, open(safe_path, "wb") as target:
-                    shutil.copyfileobj(source, target)
 
-        print(f"✅ Clean-extracted: {zip_path} ➜ {extract_path}")
-    except Exception as e:
-        print(f"❌ Failed to extract {zip_path}: {e}")
+def verify_member(zip_ref, member, safe_path, zip_name, report, store=None):
+    """Extract one member with a streaming CRC check and record it; returns (status, bytes written)"""
+    size = crc = None
+    written = 0
+    try:
+        if store is None:
+            size, crc = copy_member_verified(zip_ref, member, safe_path)
+            written = size
+        else:
+            size, crc, written = store_member(zip_ref, member, safe_path, store)
+        status = 'ok' if (size, crc) == (member.file_size, member.CRC) else 'crc_mismatch'
+    except (zipfile.BadZipFile, zlib.error, EOFError) as e:
+        # zipfile raises on a bad CRC itself once the member is fully read
+        status = 'crc_mismatch' if 'CRC' in str(e) else 'corrupt'
+    except OSError:
+        status = 'write_error'
+
+    if status != 'ok' and os.path.lexists(safe_path):
+        remove_file(safe_path)
+    report.append({'zip': zip_name, 'member': member.filename, 'output': safe_path,
+                   'size': size, 'crc': crc, 'status': status})
+    return status, written
+
+
+def extract_verified(open_zip, zip_name, extract_root, reserved, quarantine_dir, retries=VERIFY_RETRIES,
+                     store=None):
+    """CRC-checked extraction of one inner zip with retries; quarantine it if it stays bad
+
+    open_zip() must return a fresh readable file object for each attempt.
+    Returns (counters, report records).
+    """
+    for attempt in range(1, retries + 2):
+        # Each attempt plans names from the same starting point
+        attempt_reserved = set(reserved)
+        records = []
+        with open_zip() as zip_file:
+            counters = safe_extract_zip_to_naccid(zip_file, extract_root, zip_name=zip_name,
+                                                  reserved=attempt_reserved, report=records, store=store)
+        for record in records:
+            record['attempt'] = attempt
+        if counters['errors'] == 0:
+            reserved.update(attempt_reserved)
+            return counters, records
+        print(f"⚠️ Integrity check failed for {zip_name} (attempt {attempt}/{retries + 1})")
+
+    # Don't leave a partial patient folder behind: drop what was written and keep the zip aside
+    for record in records:
+        if record['status'] == 'ok' and os.path.lexists(record['output']):
+            remove_file(record['output'])
+        record['status'] = f"quarantined:{record['status']}"
+    # An empty NACCID folder would still count the patient as present downstream
+    folder_naccid = extract_nacc_id(zip_name)
+    extract_path = long_path(os.path.join(extract_root, folder_naccid)) if folder_naccid else None
+    if extract_path and os.path.isdir(extract_path) and not os.listdir(extract_path):
+        os.rmdir(extract_path)
+    os.makedirs(quarantine_dir, exist_ok=True)
+    with open_zip() as source, open(os.path.join(quarantine_dir, zip_name), "wb") as target:
+        shutil.copyfileobj(source, target, COPY_BUFFER)
+    records.append({'zip': zip_name, 'member': '', 'output': os.path.join(quarantine_dir, zip_name),
+                    'size': None, 'crc': None, 'status': 'quarantined', 'attempt': retries + 1})
+    print(f"❌ Quarantined {zip_name} ➜ {quarantine_dir}")
+    counters['files'] = counters['bytes_read'] = counters['bytes_written'] = 0
+    return counters, records
+
+
+def write_report(report_path, records):
+    """Per-member integrity report as CSV"""
+    with open(report_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(records)
+    bad = sum(1 for record in records if record['status'] != 'ok')
+    print(f"🧾 Integrity report: {len(records)} entries, {bad} not ok ➜ {report_path}")
+
+
+def group_by_naccid(zip_names):
+    """Group inner zip names by the NACC ID in their basename, in sorted order"""
+    groups = {}
+    for zip_name in sorted(zip_names):
+        nacc_id = extract_nacc_id(os.path.basename(zip_name))
+        groups.setdefault(nacc_id, []).append(zip_name)
+    return groups
+
+
+def default_quarantine_dir(final_output_dir):
+    return os.path.normpath(final_output_dir) + "_quarantine"
+
 
+def check_store_volume(store, final_output_dir):
+    """Refuse a store on another volume, where every hardlink would quietly become a full copy"""
+    os.makedirs(store, exist_ok=True)
+    os.makedirs(final_output_dir, exist_ok=True)
+    if os.stat(store).st_dev != os.stat(final_output_dir).st_dev:
+        raise ValueError(f"Dedup store {store} is not on the same volume as {final_output_dir}")
+
+
+def process_main_zip(main_zip_path, temp_extract_dir, final_output_dir, dry_run=False, verify=False,
+                     quarantine_dir=None, store=None):
+    if store is not None and not dry_run:
+        check_store_volume(store, final_output_dir)
 
-def process_main_zip(main_zip_path, temp_extract_dir, final_output_dir):
     # Step 1: Unzip the main archive
     unzip_file(main_zip_path, temp_extract_dir)
 
     # Step 2: Find all .zip files inside and extract to NACCID folders
-    for root, dirs, files in os.walk(temp_extract_dir):
-        for file in files:
-            if file.endswith(".zip"):
-                inner_zip_path = os.path.join(root, file)
-                safe_extract_zip_to_naccid(inner_zip_path, final_output_dir)
+    inner_zip_paths = [
+        os.path.join(root, file)
+        for root, dirs, files in os.walk(temp_extract_dir)
+        for file in files
+        if file.endswith(".zip")
+    ]
+    quarantine_dir = quarantine_dir or default_quarantine_dir(final_output_dir)
+    records = []
+    with stage('extract', total=len(inner_zip_paths)) as stats:
+        for inner_zip_group in group_by_naccid(inner_zip_paths).values():
+            # Zips of the same patient share one name plan so they never overwrite each other
+            reserved = set()
+            for inner_zip_path in inner_zip_group:
+                if verify and not dry_run:
+                    counters, zip_records = extract_verified(
+                        lambda path=inner_zip_path: open(path, 'rb'), os.path.basename(inner_zip_path),
+                        final_output_dir, reserved, quarantine_dir, store=store)
+                    records.extend(zip_records)
+                else:
+                    counters = safe_extract_zip_to_naccid(inner_zip_path, final_output_dir,
+                                                          reserved=reserved, dry_run=dry_run, store=store)
+                count(stats, **counters)
+
+    if verify and not dry_run:
+        write_report(os.path.join(final_output_dir, REPORT_NAME), records)
+
+
+def open_inner_zip(main_zip, member, spool_limit=SPOOL_LIMIT):
+    """Open an inner zip straight from the outer archive without a temp copy"""
+    if member.compress_type == zipfile.ZIP_STORED:
+        # Stored members are seekable in place, no decompression needed
+        return main_zip.open(member)
+
+    # Deflated streams restart on every backward seek, so buffer this one zip
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_limit)
+    with main_zip.open(member) as source:
+        shutil.copyfileobj(source, spool, COPY_BUFFER)
+    spool.seek(0)
+    return spool
+
+
+def list_inner_zips(main_zip_path):
+    """List the inner .zip members of the outer archive"""
+    with zipfile.ZipFile(main_zip_path, 'r') as main_zip:
+        return [
+            member.filename for member in main_zip.infolist()
+            if not member.is_dir() and member.filename.endswith(".zip")
+        ]
+
+
+def _init_stream_worker(main_zip_path, spool_limit=SPOOL_LIMIT):
+    global _worker_main_zip, _worker_spool_limit
+    _worker_main_zip = zipfile.ZipFile(main_zip_path, 'r')
+    _worker_spool_limit = spool_limit
+
+
+def _stream_extract_naccid(inner_names, final_output_dir, dry_run=False, verify=False, quarantine_dir=None,
+                           store=None):
+    totals = {'items': 0, 'files': 0, 'bytes_read': 0, 'bytes_written': 0, 'errors': 0}
+    records = []
+    reserved = set()
+    for inner_name in inner_names:
+        zip_name = os.path.basename(inner_name)
+        try:
+            member = _worker_main_zip.getinfo(inner_name)
+            if verify and not dry_run:
+                counters, zip_records = extract_verified(
+                    lambda: open_inner_zip(_worker_main_zip, member, _worker_spool_limit), zip_name,
+                    final_output_dir, reserved, quarantine_dir, store=store)
+                records.extend(zip_records)
+            else:
+                with open_inner_zip(_worker_main_zip, member, _worker_spool_limit) as inner_zip:
+                    counters = safe_extract_zip_to_naccid(inner_zip, final_output_dir, zip_name=zip_name,
+                                                          reserved=reserved, dry_run=dry_run, store=store)
+        except Exception as e:
+            counters = {'items': 1, 'errors': 1}
+            records.append({'zip': zip_name, 'member': '', 'output': '', 'size': None, 'crc': None,
+                            'status': 'error', 'attempt': None})
+            print(f"❌ Failed to stream {inner_name}: {e}")
+        for name, value in counters.items():
+            totals[name] += value
+    return totals, records
+
+
+def process_main_zip_streaming(main_zip_path, final_output_dir, workers=None, dry_run=False, verify=False,
+                               quarantine_dir=None, store=None):
+    """Extract inner zips directly from the outer archive across a process pool"""
+    if store is not None and not dry_run:
+        check_store_volume(store, final_output_dir)
+    inner_groups = list(group_by_naccid(list_inner_zips(main_zip_path)).values())
+    inner_count = sum(map(len, inner_groups))
+    workers = workers or os.cpu_count() or 1
+    spool_limit = SPOOL_LIMIT // workers
+    quarantine_dir = quarantine_dir or default_quarantine_dir(final_output_dir)
+    print(f"📦 Streaming {inner_count} inner zips from {main_zip_path} with {workers} workers")
+
+    records = []
+    with stage('extract', total=inner_count) as stats:
+        if workers == 1:
+            _init_stream_worker(main_zip_path, spool_limit)
+            try:
+                for inner_names in inner_groups:
+                    counters, zip_records = _stream_extract_naccid(inner_names, final_output_dir, dry_run,
+                                                                   verify, quarantine_dir, store)
+                    records.extend(zip_records)
+                    count(stats, **counters)
+            finally:
+                _worker_main_zip.close()
+        else:
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=_init_stream_worker,
+                                     initargs=(main_zip_path, spool_limit)) as executor:
+                # One task per NACCID so its name plan covers all of the patient's zips
+                futures = [
+                    executor.submit(_stream_extract_naccid, inner_names, final_output_dir, dry_run,
+                                    verify, quarantine_dir, store)
+                    for inner_names in inner_groups
+                ]
+                for future in as_completed(futures):
+                    counters, zip_records = future.result()
+                    records.extend(zip_records)
+                    count(stats, **counters)
+
+    if verify and not dry_run:
+        write_report(os.path.join(final_output_dir, REPORT_NAME), records)
 
 
 def main():
     main_zip = "DICOM_0417.zip"
     temp_folder = "C:\\extraction_temp"         # Keep root-level for short path
     clean_output = "C:\\DICOM_cleaned_output"   # Final cleaned location
+    use_streaming = True                        # Read inner zips straight from the main zip
+    workers = os.cpu_count()                    # Parallel per-patient extractions
+    dry_run = False                             # Only print the planned output names
+    verify = False                              # CRC-check every member, retry and quarantine bad zips
+    dedup_store = None                          # e.g. "C:\\DICOM_blobs" on clean_output's volume: store duplicates once
 
-    os.makedirs(temp_folder, exist_ok=True)
     os.makedirs(clean_output, exist_ok=True)
 
-    process_main_zip(main_zip, temp_folder, clean_output)
+    if use_streaming:
+        process_main_zip_streaming(main_zip, clean_output, workers=workers, dry_run=dry_run, verify=verify,
+                                   store=dedup_store)
+    else:
+        os.makedirs(temp_folder, exist_ok=True)
+        process_main_zip(main_zip, temp_folder, clean_output, dry_run=dry_run, verify=verify, store=dedup_store)
 
 
 if __name__ == "__main__":
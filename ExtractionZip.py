@@ -2,7 +2,10 @@ import os
 import zipfile
 import shutil
 import re
-import hashlib
+import sqlite3
+from Extraction import plan_output_names, name_key, open_new
+
+MANIFEST_NAME = ".extraction_manifest.sqlite"
 
 
 def extract_nacc_id(name):
@@ -23,63 +26,177 @@ def long_path(path):
         return path  # fallback
 
 
-def unzip_file(zip_path, extract_to):
+def open_manifest(manifest_path):
+    """Open (or create) the SQLite manifest of already extracted members"""
+    # Default rollback journal: the manifest lives next to the output, often on SMB/NFS,
+    # where WAL's shared-memory index does not work
+    conn = sqlite3.connect(manifest_path)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS inner_zips ("
+        " inner_zip TEXT PRIMARY KEY, file_size INTEGER, crc INTEGER, complete INTEGER)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS members ("
+        " inner_zip TEXT, member TEXT, file_size INTEGER, crc INTEGER, output_path TEXT,"
+        " PRIMARY KEY (inner_zip, member))"
+    )
+    conn.commit()
+    return conn
+
+
+def load_member_records(manifest, inner_zip):
+    """Map member name -> (size, crc, output path) recorded for one inner zip"""
+    rows = manifest.execute(
+        "SELECT member, file_size, crc, output_path FROM members WHERE inner_zip = ?",
+        (inner_zip,),
+    )
+    return {member: (size, crc, path) for member, size, crc, path in rows}
+
+
+def is_inner_zip_complete(manifest, inner_zip, file_size, crc):
+    """True when the inner zip was fully extracted and all its outputs are still on disk"""
+    row = manifest.execute(
+        "SELECT file_size, crc, complete FROM inner_zips WHERE inner_zip = ?",
+        (inner_zip,),
+    ).fetchone()
+    if row is None or row != (file_size, crc, 1):
+        return False
+    # Outputs deleted since the last run send the zip back through extraction
+    return all(is_output_present(output_path, size)
+               for size, _, output_path in load_member_records(manifest, inner_zip).values())
+
+
+def mark_inner_zip(manifest, inner_zip, file_size, crc, complete):
+    manifest.execute(
+        "INSERT OR REPLACE INTO inner_zips (inner_zip, file_size, crc, complete) VALUES (?, ?, ?, ?)",
+        (inner_zip, file_size, crc, int(complete)),
+    )
+    manifest.commit()
+
+
+def load_reserved_names(manifest):
+    """Output names already recorded in the manifest, per NACCID folder"""
+    reserved = {}
+    for (output_path,) in manifest.execute("SELECT output_path FROM members"):
+        reserved.setdefault(os.path.dirname(output_path), set()).add(name_key(os.path.basename(output_path)))
+    return reserved
+
+
+def is_output_present(output_path, file_size):
     try:
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(extract_to)
-        print(f"✅ Unzipped: {zip_path} ➜ {extract_to}")
-    except Exception as e:
-        print(f"❌ Failed to unzip {zip_path}: {e}")
+        return os.path.getsize(output_path) == file_size
+    except OSError:
+        return False
+
 
+def is_member_current(record, member):
+    """True when the recorded member matches the central directory and is on disk"""
+    if record is None:
+        return False
+    size, crc, output_path = record
+    if (size, crc) != (member.file_size, member.CRC):
+        return False
+    return is_output_present(output_path, member.file_size)
 
-def safe_extract_zip_to_naccid(zip_path, extract_root):
+
+def safe_extract_zip_to_naccid(zip_path, extract_root, manifest=None, inner_zip=None, reserved=None):
+    """Extract a per-patient zip, skipping members the manifest says are already on disk
+
+    New members are named by plan_output_names, avoiding the names in `reserved`
+    (the ones already used in this NACCID folder), so names never depend on disk state.
+    """
     try:
         zip_name = os.path.basename(zip_path)
+        inner_zip = inner_zip or zip_name
         folder_naccid = extract_nacc_id(zip_name)
         if not folder_naccid:
             print(f"⚠️ Skipped (no NACC ID in zip name): {zip_name}")
-            return
+            return True
 
         extract_path = long_path(os.path.join(extract_root, folder_naccid))
-        os.makedirs(os.path.dirname(extract_path), exist_ok=True)
+        os.makedirs(extract_path, exist_ok=True)
+
+        records = load_member_records(manifest, inner_zip) if manifest is not None else {}
+        skipped = 0
 
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            targets, new_members = [], []
             for member in zip_ref.infolist():
                 if member.is_dir():
                     continue
 
-                # Try to extract NACC ID from filename or fallback to folder
-                nacc_id = extract_nacc_id(member.filename) or folder_naccid
-                ext = os.path.splitext(member.filename)[1]
-                filename = f"{nacc_id}{ext}"
-
-                safe_path = long_path(os.path.join(extract_path, filename))
+                record = records.get(member.filename)
+                if is_member_current(record, member):
+                    skipped += 1
+                elif record is not None:
+                    # Changed member: rewrite it in place under its recorded name
+                    targets.append((member, record[2]))
+                else:
+                    new_members.append(member)
 
-                # Avoid overwriting with hash if name repeats
-                if os.path.exists(safe_path):
-                    short_hash = hashlib.md5(member.filename.encode()).hexdigest()[:6]
-                    filename = f"{nacc_id}_{short_hash}{ext}"
-                    safe_path = long_path(os.path.join(extract_path, filename))
+            for member, filename in plan_output_names(new_members, folder_naccid, reserved):
+                targets.append((member, os.path.join(extract_path, filename)))
 
-                os.makedirs(os.path.dirname(safe_path), exist_ok=True)
-                with zip_ref.open(member) as source, open(safe_path, "wb") as target:
+            for member, safe_path in targets:
+                with zip_ref.open(member) as source, open_new(safe_path) as target:
                     shutil.copyfileobj(source, target)
 
-        print(f"✅ Clean-extracted: {zip_path} ➜ {extract_path}")
+                if manifest is not None:
+                    manifest.execute(
+                        "INSERT OR REPLACE INTO members"
+                        " (inner_zip, member, file_size, crc, output_path) VALUES (?, ?, ?, ?, ?)",
+                        (inner_zip, member.filename, member.file_size, member.CRC, safe_path),
+                    )
+
+        if manifest is not None:
+            manifest.commit()
+
+        print(f"✅ Clean-extracted: {zip_path} ➜ {extract_path} ({skipped} already up to date)")
+        return True
     except Exception as e:
+        if manifest is not None:
+            # Keep the members that were fully written before the failure
+            manifest.commit()
         print(f"❌ Failed to extract {zip_path}: {e}")
+        return False
+
+
+def process_main_zip(main_zip_path, temp_extract_dir, final_output_dir, manifest_path=None):
+    """Extract new or changed inner zips, resuming from the manifest of earlier runs"""
+    manifest_path = manifest_path or os.path.join(final_output_dir, MANIFEST_NAME)
+    manifest = open_manifest(manifest_path)
 
+    try:
+        # Names already taken per NACCID folder, so inner zips of the same patient never collide
+        reserved_by_folder = load_reserved_names(manifest)
+
+        with zipfile.ZipFile(main_zip_path, 'r') as main_zip:
+            for member in main_zip.infolist():
+                if member.is_dir() or not member.filename.endswith(".zip"):
+                    continue
 
-def process_main_zip(main_zip_path, temp_extract_dir, final_output_dir):
-    # Step 1: Unzip the main archive
-    unzip_file(main_zip_path, temp_extract_dir)
+                inner_zip = member.filename
+                if is_inner_zip_complete(manifest, inner_zip, member.file_size, member.CRC):
+                    continue
 
-    # Step 2: Find all .zip files inside and extract to NACCID folders
-    for root, dirs, files in os.walk(temp_extract_dir):
-        for file in files:
-            if file.endswith(".zip"):
-                inner_zip_path = os.path.join(root, file)
-                safe_extract_zip_to_naccid(inner_zip_path, final_output_dir)
+                # Only the inner zips that still need work are copied out of the main archive
+                mark_inner_zip(manifest, inner_zip, member.file_size, member.CRC, complete=False)
+                inner_zip_path = main_zip.extract(member, temp_extract_dir)
+                folder_naccid = extract_nacc_id(os.path.basename(inner_zip))
+                reserved = reserved_by_folder.setdefault(
+                    long_path(os.path.join(final_output_dir, folder_naccid or '')), set())
+                try:
+                    ok = safe_extract_zip_to_naccid(
+                        inner_zip_path, final_output_dir, manifest=manifest, inner_zip=inner_zip,
+                        reserved=reserved
+                    )
+                finally:
+                    os.remove(inner_zip_path)
+
+                if ok:
+                    mark_inner_zip(manifest, inner_zip, member.file_size, member.CRC, complete=True)
+    finally:
+        manifest.close()
 
 
 def main():
@@ -0,0 +1,294 @@
+import io
+import os
+import sys
+import csv
+import json
+import time
+import random
+import runpy
+import shutil
+import zipfile
+import argparse
+import tempfile
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Extra CSV columns so the synthetic file is as wide as the real extract
+FILLER_COLUMNS = [f"VAR{i:03d}" for i in range(40)]
+CDRGLOB_VALUES = [0.0, 0.5, 1.0, 2.0, 3.0]
+
+SCALES = {
+    'small': {'rows': 1_000, 'images': 10_000, 'patients': 20, 'slices': 20},
+    'medium': {'rows': 1_000_000, 'images': 100_000, 'patients': 200, 'slices': 100},
+    'large': {'rows': 10_000_000, 'images': 1_000_000, 'patients': 2_000, 'slices': 200},
+}
+
+
+def nacc_id(number):
+    return f"NACC{number:06d}"
+
+
+def generate_csv(csv_path, rows, patients, seed=0):
+    """Synthetic commercial_nacc65a.csv with several visits per patient"""
+    rng = random.Random(seed)
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['NACCID', 'VISITYR', 'CDRGLOB'] + FILLER_COLUMNS)
+        filler = [rng.randint(-4, 99) for _ in FILLER_COLUMNS]
+        for _ in range(rows):
+            writer.writerow([nacc_id(rng.randrange(patients)), rng.randint(2005, 2023),
+                             rng.choice(CDRGLOB_VALUES)] + filler)
+
+
+def generate_unique_ids(excel_path, patients):
+    """uniquePatientData.xlsx with every synthetic NACCID (needs pandas and openpyxl)"""
+    try:
+        import pandas as pd
+        pd.DataFrame({'NACCID': [nacc_id(i) for i in range(patients)]}).to_excel(excel_path, index=False)
+        return True
+    except ImportError as e:
+        print(f"⚠️ Skipped {excel_path}: {e}")
+        return False
+
+
+def tiny_jpeg():
+    """Bytes of a small valid JPEG (Pillow), or a bare SOI/EOI marker pair without it"""
+    try:
+        from PIL import Image
+        buffer = io.BytesIO()
+        Image.new('L', (64, 64), color=128).save(buffer, format='JPEG')
+        return buffer.getvalue()
+    except ImportError:
+        return b'\xff\xd8\xff\xd9'
+
+
+def generate_images(image_folder, images, patients):
+    """NACC_jpg folder of <NACCID>_<series>_<slice>.jpg files"""
+    os.makedirs(image_folder, exist_ok=True)
+    data = tiny_jpeg()
+    per_patient = max(images // max(patients, 1), 1)
+    for i in range(images):
+        name = f"{nacc_id(i // per_patient)}_{1 + i % 3}_{i % per_patient}.jpg"
+        with open(os.path.join(image_folder, name), 'wb') as f:
+            f.write(data)
+
+
+def generate_nested_zip(zip_path, patients, slices, slice_size, seed=0):
+    """DICOM_0417.zip-style archive: one inner zip per patient holding .dcm-like slices"""
+    rng = random.Random(seed)
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as main_zip:
+        for patient in range(patients):
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as inner_zip:
+                for slice_number in range(slices):
+                    # 128-byte preamble + DICM magic, then partly compressible payload
+                    payload = b'\0' * 128 + b'DICM' + rng.randbytes(slice_size // 2) + b'\0' * (slice_size // 2)
+                    inner_zip.writestr(f"{nacc_id(patient)}/series1/IM{slice_number:05d}.dcm", payload)
+            main_zip.writestr(f"DICOM/{nacc_id(patient)}.zip", buffer.getvalue())
+
+
+def generate(workdir, rows, images, patients, slices, slice_size):
+    """Write every synthetic input under the default names the scripts expect"""
+    os.makedirs(workdir, exist_ok=True)
+    steps = [
+        ('commercial_nacc65a.csv', lambda: generate_csv(os.path.join(workdir, 'commercial_nacc65a.csv'), rows, patients)),
+        ('uniquePatientData.xlsx', lambda: generate_unique_ids(os.path.join(workdir, 'uniquePatientData.xlsx'), patients)),
+        ('NACC_jpg', lambda: generate_images(os.path.join(workdir, 'NACC_jpg'), images, patients)),
+        ('DICOM_0417.zip', lambda: generate_nested_zip(os.path.join(workdir, 'DICOM_0417.zip'),
+                                                       patients, slices, slice_size)),
+    ]
+    for name, step in steps:
+        start = time.perf_counter()
+        step()
+        print(f"🧪 Generated {name} in {time.perf_counter() - start:.1f}s")
+
+    # classificationDicom reads the un-suffixed file name
+    shutil.copyfile(os.path.join(workdir, 'commercial_nacc65a.csv'), os.path.join(workdir, 'commercial_nacc65.csv'))
+
+
+def _run_script(name):
+    runpy.run_path(os.path.join(REPO_DIR, name), run_name='__main__')
+
+
+def _folder_stats(path):
+    files = total = 0
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            files += 1
+            total += os.path.getsize(os.path.join(root, name))
+    return files, total
+
+
+def stage_csv_load(cold):
+    from naccMetadata import load_nacc_metadata
+    if cold:
+        shutil.rmtree('.nacc_cache', ignore_errors=True)
+    df = load_nacc_metadata('commercial_nacc65a.csv')
+    return len(df), os.path.getsize('commercial_nacc65a.csv')
+
+
+def stage_image_index(cold):
+    from imageIndex import build_image_index
+    if cold:
+        shutil.rmtree('.nacc_cache', ignore_errors=True)
+    index = build_image_index('NACC_jpg')
+    return sum(map(len, index.values())), 0
+
+
+def stage_extract_stream():
+    import Extraction
+    shutil.rmtree('DICOM_cleaned_output', ignore_errors=True)
+    Extraction.process_main_zip_streaming('DICOM_0417.zip', 'DICOM_cleaned_output')
+    return _folder_stats('DICOM_cleaned_output')
+
+
+def stage_extract_resume(cold):
+    import ExtractionZip
+    if cold:
+        shutil.rmtree('DICOM_manifest_output', ignore_errors=True)
+    os.makedirs('extraction_temp', exist_ok=True)
+    os.makedirs('DICOM_manifest_output', exist_ok=True)
+    ExtractionZip.process_main_zip('DICOM_0417.zip', 'extraction_temp', 'DICOM_manifest_output')
+    return _folder_stats('DICOM_manifest_output')
+
+
+def stage_script(script, output):
+    _run_script(script)
+    return _folder_stats(output) if os.path.isdir(output) else (1, os.path.getsize(output))
+
+
+# Stage name -> callable run inside a fresh child process with cwd = workdir
+STAGES = {
+    'csv_load_cold': lambda: stage_csv_load(cold=True),
+    'csv_load_warm': lambda: stage_csv_load(cold=False),
+    'image_index_cold': lambda: stage_image_index(cold=True),
+    'image_index_warm': lambda: stage_image_index(cold=False),
+    'extract_stream': stage_extract_stream,
+    'extract_resume_cold': lambda: stage_extract_resume(cold=True),
+    'extract_resume_warm': lambda: stage_extract_resume(cold=False),
+    'ClassificationScript': lambda: stage_script('ClassificationScript.py', 'Categorization'),
+    'typeClassifed': lambda: stage_script('typeClassifed.py', 'typeClassified'),
+    'uniqueIDimage': lambda: stage_script('uniqueIDimage.py', 'uniqueID.txt'),
+    'uniqueMatching': lambda: stage_script('uniqueMatching.py', 'outputMatches.txt'),
+    'uniqueNACCimage': lambda: stage_script('uniqueNACCimage.py', 'uniqueNACCImage'),
+    'embedText': lambda: stage_script('embedText.py', 'labeledNACCImages'),
+    'classificationDicom': lambda: stage_script('classificationDicom.py', os.path.join('DICOM_cleaned_output', 'summary.xlsx')),
+}
+
+
+def run_stage_in_child(name):
+    """Entry point of the child process: run one stage and print its counters as JSON"""
+    sys.path.insert(0, REPO_DIR)
+    start = time.perf_counter()
+    items, nbytes = STAGES[name]()
+    elapsed = time.perf_counter() - start
+
+    result = {'stage': name, 'seconds': elapsed, 'items': items, 'bytes': nbytes}
+    if os.path.exists('/proc/self/io'):
+        # Read/write syscalls of this process (pool workers are not included)
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        result['read_syscalls'] = int(counters['syscr'])
+        result['write_syscalls'] = int(counters['syscw'])
+    print("BENCH_RESULT " + json.dumps(result))
+
+
+def parse_strace_summary(path):
+    """Total syscall count from an `strace -c` summary"""
+    with open(path) as f:
+        for line in f:
+            if line.strip().endswith('total'):
+                # % time, seconds, usecs/call, calls, [errors,] total
+                return int(line.split()[3])
+    return None
+
+
+def benchmark_stage(name, workdir, use_strace=False):
+    """Run one stage in a fresh process and collect time, throughput, peak RSS and syscalls"""
+    command = [sys.executable, os.path.abspath(__file__), 'stage', name]
+    strace_path = None
+    if use_strace and shutil.which('strace'):
+        fd, strace_path = tempfile.mkstemp(suffix='.strace')
+        os.close(fd)
+        command = ['strace', '-f', '-c', '-o', strace_path] + command
+
+    process = subprocess.Popen(command, cwd=workdir, stdout=subprocess.PIPE, text=True)
+    output = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    result = {'stage': name, 'failed': process.returncode != 0}
+    for line in output.splitlines():
+        if line.startswith("BENCH_RESULT "):
+            result.update(json.loads(line[len("BENCH_RESULT "):]))
+
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    result['peak_rss_mb'] = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    if result.get('seconds'):
+        result['items_per_s'] = result['items'] / result['seconds']
+        result['mb_per_s'] = result['bytes'] / result['seconds'] / 1e6
+    if strace_path:
+        result['syscalls'] = parse_strace_summary(strace_path)
+        os.remove(strace_path)
+    return result
+
+
+def print_report(results):
+    print(f"\n{'Stage':<22}{'Time (s)':>10}{'Items/s':>12}{'MB/s':>9}{'Peak RSS MB':>13}{'Syscalls':>11}")
+    for r in results:
+        if r['failed']:
+            print(f"{r['stage']:<22}{'failed':>10}")
+            continue
+        syscalls = r.get('syscalls') or (r.get('read_syscalls', 0) + r.get('write_syscalls', 0)) or ''
+        print(f"{r['stage']:<22}{r['seconds']:>10.2f}{r.get('items_per_s', 0):>12.0f}{r.get('mb_per_s', 0):>9.1f}"
+              f"{r['peak_rss_mb']:>13.0f}{syscalls:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic-data benchmarks for the NACC scripts")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    gen = sub.add_parser('generate', help="Write synthetic CSV, Excel, image folder and nested zip")
+    gen.add_argument('workdir')
+    gen.add_argument('--scale', choices=list(SCALES), default='small')
+    gen.add_argument('--rows', type=int)
+    gen.add_argument('--images', type=int)
+    gen.add_argument('--patients', type=int)
+    gen.add_argument('--slices', type=int, help="Slices per patient in the nested zip")
+    gen.add_argument('--slice-size', type=int, default=64 * 1024)
+
+    run = sub.add_parser('run', help="Time each stage on generated data")
+    run.add_argument('workdir')
+    run.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES))
+    run.add_argument('--strace', action='store_true', help="Count all syscalls with strace -f -c")
+    run.add_argument('--output', help="Append the results as JSON lines to this file")
+
+    stage = sub.add_parser('stage', help=argparse.SUPPRESS)
+    stage.add_argument('name', choices=list(STAGES))
+
+    args = parser.parse_args()
+    if args.command == 'generate':
+        scale = SCALES[args.scale]
+        generate(args.workdir,
+                 rows=args.rows or scale['rows'],
+                 images=args.images or scale['images'],
+                 patients=args.patients or scale['patients'],
+                 slices=args.slices or scale['slices'],
+                 slice_size=args.slice_size)
+    elif args.command == 'run':
+        results = []
+        for name in args.stages:
+            print(f"⏱️ {name}")
+            results.append(benchmark_stage(name, args.workdir, args.strace))
+        print_report(results)
+        if args.output:
+            with open(args.output, 'a') as f:
+                for result in results:
+                    f.write(json.dumps(result) + "\n")
+    else:
+        run_stage_in_child(args.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 import os
 import pandas as pd
 import re
+from naccMetadata import load_nacc_metadata, iter_nacc_csv
 
 
 def extract_nacc_id(name):
@@ -17,61 +18,133 @@ def get_naccids_from_folder(folder_path):
     return nacc_ids
 
 
-def categorize_cdrglob(score):
-    category_map = {
-        0.0: "0_No_Alzheimers",
-        0.5: "0.5_Cognitively_Impaired",
-        1.0: "1_Mild",
-        2.0: "2_Moderate",
-        3.0: "3_Severe"
-    }
-    return category_map.get(score, "Unknown")
+CDRGLOB_CATEGORIES = {
+    0.0: "0_No_Alzheimers",
+    0.5: "0.5_Cognitively_Impaired",
+    1.0: "1_Mild",
+    2.0: "2_Moderate",
+    3.0: "3_Severe"
+}
+
+VISIT_POLICIES = ('latest', 'closest', 'max')
 
 
-def analyze_patient_categories(folder_path, csv_path, output_excel):
+def categorize_cdrglob(score):
+    return CDRGLOB_CATEGORIES.get(score, "Unknown")
+
+
+def visits_for_ids(df, nacc_ids):
+    """Visit rows (NACCID, VISITYR, CDRGLOB) of the given patients, NACCIDs stripped"""
+    ids = df['NACCID']
+    if isinstance(ids.dtype, pd.CategoricalDtype):
+        # Strip and match the categories once instead of every row
+        categories = pd.Index(ids.cat.categories.astype(str).str.strip())
+        codes = ids.cat.codes.to_numpy()
+        mask = (codes >= 0) & categories.isin(nacc_ids)[codes]
+        stripped = categories[codes[mask]]
+    else:
+        ids = ids.astype(str).str.strip()
+        mask = ids.isin(nacc_ids).to_numpy()
+        stripped = ids[mask]
+
+    return pd.DataFrame({
+        'NACCID': pd.Series(stripped, dtype=object).to_numpy(),
+        'VISITYR': df['VISITYR'].to_numpy()[mask],
+        'CDRGLOB': df['CDRGLOB'].to_numpy()[mask],
+    })
+
+
+def select_patient_visits(visits, policy='latest', scan_years=None):
+    """Pick one visit per patient: latest visit, visit closest to the scan year, or max score"""
+    if policy == 'latest':
+        # Stable sort keeps CSV order for visits in the same year, so the last one wins
+        ordered = visits.sort_values(['NACCID', 'VISITYR'], kind='stable')
+    elif policy == 'max':
+        ordered = visits.sort_values(['NACCID', 'CDRGLOB'], kind='stable', na_position='first')
+    elif policy == 'closest':
+        if scan_years is None:
+            raise ValueError("The 'closest' policy needs the scan year of each NACCID.")
+        scan_year = visits['NACCID'].map(scan_years)
+        # Patients without a scan year fall back to their latest visit
+        distance = (visits['VISITYR'] - scan_year).abs().fillna(float('inf'))
+        ordered = (visits.assign(_distance=distance)
+                   .sort_values(['NACCID', '_distance', 'VISITYR'], ascending=[True, False, True], kind='stable')
+                   .drop(columns='_distance'))
+    else:
+        raise ValueError(f"Unknown visit policy: {policy} (expected one of {', '.join(VISIT_POLICIES)})")
+
+    return ordered.drop_duplicates(subset='NACCID', keep='last').reset_index(drop=True)
+
+
+def select_patient_visits_chunked(csv_path, nacc_ids, policy='latest', scan_years=None,
+                                  memory_budget=512 * 1024 * 1024):
+    """select_patient_visits over a CSV streamed in chunks, keeping one candidate visit per patient
+
+    Every policy picks a maximum under an order that ends with CSV position, so
+    reducing each chunk together with the candidates so far gives the same visit
+    as selecting over the whole file.
+    """
+    candidates = None
+    for chunk in iter_nacc_csv(csv_path, ('NACCID', 'CDRGLOB', 'VISITYR'), memory_budget):
+        visits = visits_for_ids(chunk, nacc_ids)
+        if candidates is not None:
+            # Earlier candidates go first so CSV order is kept for ties
+            visits = pd.concat([candidates, visits], ignore_index=True)
+        candidates = select_patient_visits(visits, policy, scan_years)
+    if candidates is None:
+        return pd.DataFrame({'NACCID': [], 'VISITYR': [], 'CDRGLOB': []})
+    return candidates
+
+
+def analyze_patient_categories(folder_path, csv_path, output_excel, df=None, policy='latest', scan_years=None,
+                               memory_budget=None):
     print(f"🔍 Scanning folder: {folder_path}")
     nacc_ids = get_naccids_from_folder(folder_path)
     print(f"🧠 Found {len(nacc_ids)} unique patients (NACCIDs) in folder.")
 
-    df = pd.read_csv(csv_path)
-    df['NACCID'] = df['NACCID'].astype(str).str.strip()
-    df_map = dict(zip(df['NACCID'], df['CDRGLOB']))
-
-    category_counts = {}
-    summary_rows = []
-    matched_count = 0
-
-    for nacc_id in sorted(nacc_ids):
-        if nacc_id in df_map:
-            score = df_map[nacc_id]
-            category = categorize_cdrglob(score)
-            category_counts[category] = category_counts.get(category, 0) + 1
-            matched_count += 1
-        else:
-            print(f"⚠️ NACCID {nacc_id} not found in CSV.")
-
-    print("\n📊 Patients per Alzheimer's Category:")
-    for category, count in sorted(category_counts.items()):
+    if df is None and memory_budget is not None:
+        # Chunked mode: the CSV is never loaded whole
+        patients = select_patient_visits_chunked(csv_path, nacc_ids, policy, scan_years, memory_budget)
+    else:
+        if df is None:
+            df = load_nacc_metadata(csv_path, columns=('NACCID', 'CDRGLOB', 'VISITYR'))
+
+        # Join the scanned NACCIDs against the visits instead of building a dict of the whole CSV
+        patients = select_patient_visits(visits_for_ids(df, nacc_ids), policy, scan_years)
+    patients['Category'] = patients['CDRGLOB'].map(CDRGLOB_CATEGORIES).fillna("Unknown")
+    patients = patients.sort_values('NACCID', ignore_index=True)
+    matched_count = len(patients)
+
+    for nacc_id in sorted(nacc_ids.difference(patients['NACCID'])):
+        print(f"⚠️ NACCID {nacc_id} not found in CSV.")
+
+    category_counts = patients['Category'].value_counts().sort_index()
+    summary_df = pd.DataFrame({"Category": category_counts.index, "Patient Count": category_counts.to_numpy()})
+
+    print(f"\n📊 Patients per Alzheimer's Category ({policy} visit):")
+    for category, count in category_counts.items():
         print(f"{category}: {count} patients")
-        summary_rows.append({"Category": category, "Patient Count": count})
 
     print(f"\n✅ Total matched in CSV: {matched_count}")
     print(f"🔎 Total NACCIDs scanned: {len(nacc_ids)}")
 
-    # Save summary to Excel
-    summary_df = pd.DataFrame(summary_rows)
+    # Save summary and the per-patient visit used to Excel
     with pd.ExcelWriter(output_excel, engine='xlsxwriter') as writer:
         summary_df.to_excel(writer, index=False, sheet_name='Summary')
+        patients.to_excel(writer, index=False, sheet_name='Patients')
 
     print(f"\n💾 Saved summary to Excel: {output_excel}")
+    return patients, summary_df
 
 
 def main():
     dicom_folder = "DICOM_cleaned_output"              # Folder with NACCID-named subfolders
     csv_path = "commercial_nacc65.csv"                     # Metadata CSV
-    output_excel = "DICOM_cleaned_output\\summary.xlsx"  # Summary Excel
+    output_excel = os.path.join("DICOM_cleaned_output", "summary.xlsx")  # Summary Excel
+    policy = 'latest'                                     # Visit used per patient: 'latest', 'closest' or 'max'
+    memory_budget = None                                  # e.g. 512 * 1024 * 1024 to stream the CSV in chunks
 
-    analyze_patient_categories(dicom_folder, csv_path, output_excel)
+    analyze_patient_categories(dicom_folder, csv_path, output_excel, policy=policy, memory_budget=memory_budget)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,82 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+# File operations kept in flight at once; on a high-latency mount this, not bandwidth,
+# bounds throughput, so it is well above the CPU count
+IN_FLIGHT_LIMIT = 64
+
+
+async def _run_bounded(func, calls, in_flight, workers, collect):
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(in_flight)
+    results = {} if collect else None
+    errors = []
+    pending = set()
+
+    async def run(i, args):
+        try:
+            result = await loop.run_in_executor(executor, func, *args)
+            if collect:
+                results[i] = result
+        except Exception as e:
+            errors.append(e)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers or in_flight) as executor:
+        submitted = 0
+        for args in calls:
+            # Backpressure: the next call is only pulled from `calls` once a slot frees up
+            await slots.acquire()
+            if errors:
+                slots.release()
+                break
+            # Only the in-flight tasks are referenced, finished ones are dropped right away
+            task = asyncio.create_task(run(submitted, args))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            submitted += 1
+        if pending:
+            await asyncio.wait(set(pending))
+
+    if errors:
+        raise errors[0]
+    return [results[i] for i in range(submitted)] if collect else None
+
+
+def run_concurrently(func, calls, in_flight=IN_FLIGHT_LIMIT, workers=None, collect=True):
+    """Run func(*args) for every args in calls with at most in_flight pending
+
+    Returns the results in order when collect is True, which keeps one result
+    per call in memory; with collect=False only the in-flight calls are held.
+    The first exception stops pulling new calls and is re-raised once the
+    in-flight ones finish.
+    """
+    if in_flight <= 1:
+        results = [func(*args) for args in calls]
+        return results if collect else None
+
+    coroutine = _run_bounded(func, calls, in_flight, workers, collect)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    # Called from inside an event loop (e.g. a notebook): run ours on a helper thread
+    with ThreadPoolExecutor(max_workers=1) as helper:
+        return helper.submit(asyncio.run, coroutine).result()
+
+
+def write_text(path, text):
+    with open(path, 'w') as file:
+        file.write(text)
+
+
+def write_files(items, in_flight=IN_FLIGHT_LIMIT):
+    """Write many (path, text) pairs concurrently"""
+    run_concurrently(write_text, items, in_flight, collect=False)
+
+
+def make_dirs(paths, in_flight=IN_FLIGHT_LIMIT):
+    """Create many folders concurrently; shared parents are safe because exist_ok tolerates the race"""
+    run_concurrently(os.makedirs, ((path, 0o777, True) for path in set(paths)), in_flight, collect=False)
@@ -0,0 +1,130 @@
+import io
+import os
+import json
+import random
+import tarfile
+import numpy as np
+
+from imageIndex import build_image_index
+from uniqueNACCimage import alzheimers_category
+
+# type_<Type> folder name -> CDRGLOB score
+TYPE_TO_CDRGLOB = {name: score for score, name in alzheimers_category.items()}
+
+EXPORT_FORMATS = ('tar', 'npy')
+
+
+def list_classified_samples(classified_folder):
+    """(image path, NACCID, Type, CDRGLOB, size) for every image in the type_* folders"""
+    samples = []
+    for entry in sorted(os.scandir(classified_folder), key=lambda e: e.name):
+        if not entry.is_dir() or not entry.name.startswith('type_'):
+            continue
+        image_type = entry.name[len('type_'):]
+        cdrglob = TYPE_TO_CDRGLOB.get(image_type, float('nan'))
+        for nacc_id, images in sorted(build_image_index(entry.path, use_cache=False).items()):
+            for image in sorted(images):
+                samples.append((image.path, nacc_id, image_type, cdrglob, image.size))
+    return samples
+
+
+def split_shards(samples, shard_size):
+    """Consecutive groups of samples whose image bytes stay under shard_size each"""
+    shard, shard_bytes = [], 0
+    for sample in samples:
+        size = sample[4]
+        if shard and shard_bytes + size > shard_size:
+            yield shard
+            shard, shard_bytes = [], 0
+        shard.append(sample)
+        shard_bytes += size
+    if shard:
+        yield shard
+
+
+def write_tar_shard(shard_path, shard):
+    """WebDataset-style tar: <key>.jpg plus <key>.json with the labels"""
+    # dereference: type_* folders may hold symlinks when uniqueNACCimage placed them that way
+    with tarfile.open(shard_path, 'w', dereference=True) as tar:
+        for path, nacc_id, image_type, cdrglob, _ in shard:
+            key = os.path.splitext(os.path.basename(path))[0]
+            tar.add(path, arcname=f"{key}.jpg")
+
+            cdrglob = None if np.isnan(cdrglob) else cdrglob
+            labels = json.dumps({'NACCID': nacc_id, 'CDRGLOB': cdrglob, 'Type': image_type}).encode()
+            info = tarfile.TarInfo(f"{key}.json")
+            info.size = len(labels)
+            tar.addfile(info, io.BytesIO(labels))
+
+
+def write_npy_shard(shard_path, shard):
+    """Raw JPEG bytes in one memory-mappable uint8 array plus an offsets/labels index"""
+    sizes = np.array([size for _, _, _, _, size in shard], dtype=np.int64)
+    offsets = np.zeros(len(shard) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+
+    data = np.lib.format.open_memmap(f"{shard_path}.npy", mode='w+', dtype=np.uint8, shape=(int(offsets[-1]),))
+    for (path, _, _, _, _), start, end in zip(shard, offsets[:-1], offsets[1:]):
+        with open(path, 'rb') as f:
+            f.readinto(memoryview(data[start:end]))
+    data.flush()
+    del data
+
+    np.savez(f"{shard_path}.index.npz",
+             offsets=offsets,
+             naccid=np.array([sample[1] for sample in shard]),
+             type=np.array([sample[2] for sample in shard]),
+             cdrglob=np.array([sample[3] for sample in shard], dtype=np.float32),
+             name=np.array([os.path.basename(sample[0]) for sample in shard]))
+
+
+def read_npy_sample(shard_path, i):
+    """JPEG bytes and labels of sample i in an npy shard, read through mmap"""
+    data = np.load(f"{shard_path}.npy", mmap_mode='r')
+    index = np.load(f"{shard_path}.index.npz")
+    start, end = index['offsets'][i], index['offsets'][i + 1]
+    labels = {'NACCID': str(index['naccid'][i]), 'CDRGLOB': float(index['cdrglob'][i]), 'Type': str(index['type'][i])}
+    return bytes(data[start:end]), labels
+
+
+def export_dataset(classified_folder, output_folder, export_format='tar',
+                   shard_size=1024 * 1024 * 1024, shuffle=True, seed=0):
+    """Pack the classified images and their labels into a few large shards"""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {export_format} (expected one of {', '.join(EXPORT_FORMATS)})")
+
+    samples = list_classified_samples(classified_folder)
+    if shuffle:
+        # Shuffle once here so training can read each shard sequentially
+        random.Random(seed).shuffle(samples)
+
+    os.makedirs(output_folder, exist_ok=True)
+    shard_names = []
+    for shard_number, shard in enumerate(split_shards(samples, shard_size)):
+        shard_name = f"shard-{shard_number:05d}"
+        if export_format == 'tar':
+            shard_name += ".tar"
+            write_tar_shard(os.path.join(output_folder, shard_name), shard)
+        else:
+            write_npy_shard(os.path.join(output_folder, shard_name), shard)
+        shard_names.append(shard_name)
+        print(f"📦 Wrote {shard_name} ({len(shard)} images)")
+
+    with open(os.path.join(output_folder, 'shards.json'), 'w') as f:
+        json.dump({'format': export_format, 'samples': len(samples), 'shards': shard_names}, f, indent=2)
+
+    print(f"✅ Exported {len(samples)} images into {len(shard_names)} shards under {output_folder}")
+    return shard_names
+
+
+def main():
+    classified_folder = 'uniqueNACCImage'   # Output of uniqueNACCimage.py
+    output_folder = 'uniqueNACCShards'
+    export_format = 'tar'                   # 'tar' (WebDataset-style) or 'npy' (mmap + offsets index)
+    shard_size = 1024 * 1024 * 1024         # Bytes of images per shard
+
+    export_dataset(classified_folder, output_folder, export_format, shard_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+try:
+    import pydicom
+except ImportError:
+    pydicom = None
+
+# Header fields kept per file; everything after them (PixelData) is never read
+HEADER_TAGS = [
+    'StudyDate',
+    'Modality',
+    'SeriesDescription',
+    'SeriesInstanceUID',
+    'SeriesNumber',
+    'InstanceNumber',
+    'Rows',
+    'Columns',
+    'NumberOfFrames',
+]
+
+# Files the extraction and summary steps leave next to the DICOMs
+NON_DICOM_EXTENSIONS = ('.xlsx', '.sqlite', '.json', '.txt', '.jpg', '.png')
+
+
+def list_patient_files(dicom_root):
+    """Map each NACCID folder under the extraction output to its files"""
+    patients = {}
+    with os.scandir(dicom_root) as entries:
+        for entry in entries:
+            if not entry.is_dir() or entry.name.startswith('.'):
+                continue
+            files = []
+            pending = [entry.path]
+            while pending:
+                with os.scandir(pending.pop()) as children:
+                    for child in children:
+                        if child.is_dir():
+                            pending.append(child.path)
+                        elif not child.name.lower().endswith(NON_DICOM_EXTENSIONS):
+                            files.append(child.path)
+            patients[entry.name] = sorted(files)
+    return patients
+
+
+def read_header(path):
+    """Read only the header tags of one DICOM file (never the pixel data)"""
+    ds = pydicom.dcmread(path, stop_before_pixels=True, specific_tags=HEADER_TAGS)
+    record = {tag: ds.get(tag) for tag in HEADER_TAGS}
+    for tag in ('SeriesNumber', 'InstanceNumber', 'Rows', 'Columns', 'NumberOfFrames'):
+        record[tag] = int(record[tag]) if record[tag] not in (None, '') else None
+    for tag in ('StudyDate', 'Modality', 'SeriesDescription', 'SeriesInstanceUID'):
+        record[tag] = str(record[tag]) if record[tag] is not None else None
+    return record
+
+
+def read_patient_headers(nacc_id, paths):
+    """Header records of every DICOM file in one patient folder"""
+    records = []
+    for path in paths:
+        try:
+            record = read_header(path)
+        except Exception as e:
+            # One odd header must not abort the index of the whole tree
+            print(f"⚠️ Not indexed: {path} ({e})")
+            continue
+        record['NACCID'] = nacc_id
+        record['Path'] = path
+        records.append(record)
+    return records
+
+
+def build_header_index(dicom_root, workers=None):
+    """Columnar DataFrame of header fields for every DICOM file, read across a process pool"""
+    if pydicom is None:
+        raise ImportError("pydicom is required to index DICOM headers (pip install pydicom).")
+
+    patients = list_patient_files(dicom_root)
+    workers = workers or os.cpu_count() or 1
+    print(f"🔍 Indexing DICOM headers of {len(patients)} patients with {workers} workers")
+
+    records = []
+    if workers == 1:
+        for nacc_id, paths in patients.items():
+            records.extend(read_patient_headers(nacc_id, paths))
+    else:
+        # One task per patient folder keeps the inter-process traffic small
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for patient_records in executor.map(read_patient_headers, patients.keys(), patients.values()):
+                records.extend(patient_records)
+
+    columns = ['NACCID', 'Path'] + HEADER_TAGS
+    index = pd.DataFrame.from_records(records, columns=columns)
+    index['StudyDate'] = pd.to_datetime(index['StudyDate'], format='%Y%m%d', errors='coerce')
+    for tag in ('SeriesNumber', 'InstanceNumber', 'Rows', 'Columns', 'NumberOfFrames'):
+        index[tag] = index[tag].astype('Int32')
+    for tag in ('NACCID', 'Modality'):
+        index[tag] = index[tag].astype('category')
+    return index
+
+
+def save_header_index(index, output_path):
+    """Write the index as Parquet (or CSV when the path ends in .csv)"""
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    if output_path.endswith('.csv'):
+        index.to_csv(output_path, index=False)
+    else:
+        index.to_parquet(output_path, index=False)
+    print(f"💾 Saved header index of {len(index)} files to {output_path}")
+
+
+def load_header_index(index_path):
+    if index_path.endswith('.csv'):
+        return pd.read_csv(index_path, parse_dates=['StudyDate'])
+    return pd.read_parquet(index_path)
+
+
+def scan_years_from_index(index):
+    """Earliest study year per NACCID, for the 'closest' visit policy in classificationDicom"""
+    return index.groupby('NACCID', observed=True)['StudyDate'].min().dt.year.dropna().to_dict()
+
+
+def main():
+    dicom_folder = "DICOM_cleaned_output"                    # Folder with NACCID-named subfolders
+    output_path = "DICOM_cleaned_output_headers.parquet"     # Columnar header index (.parquet or .csv)
+    workers = os.cpu_count()
+
+    index = build_header_index(dicom_folder, workers=workers)
+    save_header_index(index, output_path)
+
+
+if __name__ == "__main__":
+    main()
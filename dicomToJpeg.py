@@ -0,0 +1,215 @@
+import io
+import os
+import hashlib
+import zipfile
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from PIL import Image
+
+from Extraction import extract_nacc_id, group_by_naccid, list_inner_zips, open_inner_zip
+from dicomHeaderIndex import list_patient_files
+
+try:
+    import pydicom
+except ImportError:
+    pydicom = None
+
+# Outer archive handle opened once per worker process
+_worker_main_zip = None
+
+
+def _first(value):
+    """First item of a multi-valued DICOM element"""
+    if isinstance(value, Sequence) and not isinstance(value, str):
+        return value[0]
+    return value
+
+
+def window_to_uint8(pixels, ds):
+    """Rescale and window one 2D slice to 8-bit with vectorized NumPy"""
+    pixels = pixels.astype(np.float32)
+    slope = float(ds.get('RescaleSlope', 1) or 1)
+    intercept = float(ds.get('RescaleIntercept', 0) or 0)
+    if slope != 1:
+        pixels *= slope
+    if intercept:
+        pixels += intercept
+
+    center, width = ds.get('WindowCenter'), ds.get('WindowWidth')
+    if center is not None and width is not None:
+        center, width = float(_first(center)), max(float(_first(width)), 1.0)
+        low, high = center - width / 2, center + width / 2
+    else:
+        # No window in the header: stretch the slice's own range
+        low, high = float(pixels.min()), float(pixels.max())
+
+    scale = 255.0 / (high - low) if high > low else 0.0
+    pixels -= low
+    pixels *= scale
+    np.clip(pixels, 0, 255, out=pixels)
+    if ds.get('PhotometricInterpretation') == 'MONOCHROME1':
+        # MONOCHROME1 stores white as the lowest value
+        pixels = 255 - pixels
+    return pixels.astype(np.uint8)
+
+
+def _short_uid(uid):
+    return hashlib.blake2b(str(uid).encode(), digest_size=4).hexdigest()
+
+
+def slice_stem(ds, nacc_id):
+    """<NACCID>_<series>_<slice>_<session>, unique across the visits merged into one NACCID folder"""
+    # Series and instance numbers restart every session, so the series UID tells sessions apart
+    session = ds.get('SeriesInstanceUID') or ds.get('StudyInstanceUID') or ds.get('StudyDate')
+    series = ds.get('SeriesNumber')
+    instance = ds.get('InstanceNumber')
+    series = int(series) if series not in (None, '') else 0
+    if instance not in (None, ''):
+        instance = int(instance)
+    elif ds.get('SOPInstanceUID'):
+        instance = _short_uid(ds.SOPInstanceUID)
+    else:
+        instance = 0
+    stem = f"{nacc_id}_{series}_{instance}"
+    return f"{stem}_{_short_uid(session)}" if session else stem
+
+
+def unique_name(stem, used):
+    """stem, or stem-dupN when another slice of this patient already took it in this run"""
+    name, copy = stem, 1
+    while name in used:
+        name = f"{stem}-dup{copy}"
+        copy += 1
+    if name != stem:
+        print(f"⚠️ Name collision for {stem}, writing {name}")
+    used.add(name)
+    return name
+
+
+def dataset_to_jpegs(ds, nacc_id, jpg_folder, quality=95, used=None):
+    """Write every frame of one dataset as <NACCID>_<series>_<slice>_<session>.jpg; returns files written"""
+    used = used if used is not None else set()
+    pixels = ds.pixel_array
+    stem = slice_stem(ds, nacc_id)
+
+    is_color = ds.get('SamplesPerPixel', 1) > 1
+    frames = pixels if pixels.ndim == (4 if is_color else 3) else pixels[np.newaxis]
+
+    for frame_number, frame in enumerate(frames):
+        if is_color:
+            image = Image.fromarray(frame.astype(np.uint8))
+        else:
+            image = Image.fromarray(window_to_uint8(frame, ds), mode='L')
+
+        frame_stem = stem if len(frames) == 1 else f"{stem}-{frame_number}"
+        output_path = os.path.join(jpg_folder, f"{unique_name(frame_stem, used)}.jpg")
+        image.save(output_path, quality=quality)
+    return len(frames)
+
+
+def convert_patient_folder(nacc_id, paths, jpg_folder, quality=95):
+    """Convert the extracted DICOMs of one patient, one slice in memory at a time"""
+    written = 0
+    used = set()
+    for path in paths:
+        try:
+            written += dataset_to_jpegs(pydicom.dcmread(path), nacc_id, jpg_folder, quality, used)
+        except Exception as e:
+            print(f"⚠️ Not converted: {path} ({e})")
+    return written
+
+
+def _init_zip_worker(main_zip_path):
+    global _worker_main_zip
+    _worker_main_zip = zipfile.ZipFile(main_zip_path, 'r')
+
+
+def convert_inner_zips(inner_names, jpg_folder, quality=95):
+    """Convert DICOM members straight from the inner zips of the outer archive"""
+    written = 0
+    # All of one NACCID's zips are in this task, so names are checked across them
+    used = set()
+    for inner_name in inner_names:
+        folder_naccid = extract_nacc_id(os.path.basename(inner_name))
+        if not folder_naccid:
+            print(f"⚠️ Skipped (no NACC ID in zip name): {inner_name}")
+            continue
+        try:
+            with open_inner_zip(_worker_main_zip, _worker_main_zip.getinfo(inner_name)) as inner_file, \
+                    zipfile.ZipFile(inner_file, 'r') as inner_zip:
+                for member in inner_zip.infolist():
+                    if member.is_dir():
+                        continue
+                    nacc_id = extract_nacc_id(member.filename) or folder_naccid
+                    try:
+                        ds = pydicom.dcmread(io.BytesIO(inner_zip.read(member)))
+                        written += dataset_to_jpegs(ds, nacc_id, jpg_folder, quality, used)
+                    except Exception as e:
+                        print(f"⚠️ Not converted: {inner_name}:{member.filename} ({e})")
+        except Exception as e:
+            print(f"❌ Failed to stream {inner_name}: {e}")
+    return written
+
+
+def _run_bounded(executor, func, tasks, max_pending):
+    """Submit tasks while keeping at most max_pending in flight; returns the summed results"""
+    total = 0
+    pending = set()
+    for args in tasks:
+        if len(pending) >= max_pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            total += sum(future.result() for future in done)
+        pending.add(executor.submit(func, *args))
+    for future in pending:
+        total += future.result()
+    return total
+
+
+def convert_folder(dicom_root, jpg_folder, workers=None, quality=95):
+    """Convert the extracted DICOM_cleaned_output tree into NACC_jpg"""
+    if pydicom is None:
+        raise ImportError("pydicom is required to convert DICOM files (pip install pydicom).")
+
+    os.makedirs(jpg_folder, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    tasks = ((nacc_id, paths, jpg_folder, quality) for nacc_id, paths in list_patient_files(dicom_root).items())
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        written = _run_bounded(executor, convert_patient_folder, tasks, max_pending=workers * 2)
+    print(f"✅ Converted {written} slices from {dicom_root} ➜ {jpg_folder}")
+    return written
+
+
+def convert_main_zip(main_zip_path, jpg_folder, workers=None, quality=95):
+    """Convert DICOMs directly from the nested archive, without extracting them first"""
+    if pydicom is None:
+        raise ImportError("pydicom is required to convert DICOM files (pip install pydicom).")
+
+    os.makedirs(jpg_folder, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    inner_groups = group_by_naccid(list_inner_zips(main_zip_path)).values()
+    tasks = ((inner_names, jpg_folder, quality) for inner_names in inner_groups)
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_zip_worker,
+                             initargs=(main_zip_path,)) as executor:
+        written = _run_bounded(executor, convert_inner_zips, tasks, max_pending=workers * 2)
+    print(f"✅ Converted {written} slices from {main_zip_path} ➜ {jpg_folder}")
+    return written
+
+
+def main():
+    source = "DICOM_cleaned_output"   # Extracted NACCID folders, or the main .zip to stream from
+    jpg_folder = "NACC_jpg"
+    workers = os.cpu_count()
+    quality = 95
+
+    if source.endswith(".zip"):
+        convert_main_zip(source, jpg_folder, workers=workers, quality=quality)
+    else:
+        convert_folder(source, jpg_folder, workers=workers, quality=quality)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image, ImageDraw, ImageFont
-import pandas as pd
+from naccMetadata import load_nacc_metadata, load_unique_ids
+from imageIndex import build_image_index
+from instrumentation import stage, count
 
 # Specify file paths
 unique_ids_path = 'uniquePatientData.xlsx'
@@ -8,17 +11,13 @@ classification_path = 'commercial_nacc65a.csv'
 image_folder = 'NACC_jpg'
 output_base_folder = 'labeledNACCImages'
 
-# Load the unique IDs from the Excel file
-unique_ids_df = pd.read_excel(unique_ids_path)
-if 'NACCID' not in unique_ids_df.columns:
-    raise ValueError("The unique IDs file must contain a column named 'NACCID'.")
-
-unique_ids = set(unique_ids_df['NACCID'].astype(str))
-
-# Load the classification data from the CSV file
-classification_df = pd.read_csv(classification_path)
-if 'NACCID' not in classification_df.columns or 'CDRGLOB' not in classification_df.columns:
-    raise ValueError("The classification file must contain 'NACCID' and 'CDRGLOB' columns.")
+# Labeling engine settings
+workers = os.cpu_count()  # Parallel labeling processes
+output_quality = 95       # JPEG quality of the labeled images (None for Pillow's default)
+output_format = None      # e.g. 'JPEG', 'PNG' or 'WEBP' (None keeps the source format)
+draft_size = None         # e.g. (1024, 1024) to decode large JPEGs at reduced scale
+font_name = "arial.ttf"
+font_size = 24
 
 # Map CDRGLOB to readable categories
 alzheimers_category = {
@@ -29,43 +28,142 @@ alzheimers_category = {
     3: 'Severe'
 }
 
-classification_df['Type'] = classification_df['CDRGLOB'].map(alzheimers_category)
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp', 'TIFF': '.tif'}
+
+# Font and encoder settings, set once per worker process
+_worker_font = None
+_worker_save_settings = {}
+
+
+def load_font(name=font_name, size=font_size):
+    """Define font for the labels"""
+    try:
+        return ImageFont.truetype(name, size)
+    except IOError:
+        return ImageFont.load_default()
 
-# Filter and handle duplicate NACCIDs
-classification_filtered = classification_df[classification_df['NACCID'].astype(str).isin(unique_ids)]
-classification_filtered = classification_filtered.drop_duplicates(subset='NACCID', keep='first')
 
-# Create a dictionary mapping NACCID to classification info
-id_to_classification = classification_filtered.set_index('NACCID')[['CDRGLOB', 'Type']].to_dict('index')
+def map_ids_to_classification(unique_ids, classification_df):
+    """Map each unique NACCID to its CDRGLOB and readable type"""
+    classification_df = classification_df.assign(Type=classification_df['CDRGLOB'].map(alzheimers_category))
 
-# Create the base output folder
-if not os.path.exists(output_base_folder):
-    os.mkdir(output_base_folder)
+    # Filter and handle duplicate NACCIDs
+    classification_filtered = classification_df[classification_df['NACCID'].astype(str).isin(unique_ids)]
+    classification_filtered = classification_filtered.drop_duplicates(subset='NACCID', keep='first')
 
-# Define font for the labels
-try:
-    font = ImageFont.truetype("arial.ttf", 24)
-except IOError:
-    font = ImageFont.load_default()
+    # Create a dictionary mapping NACCID to classification info
+    return classification_filtered.set_index('NACCID')[['CDRGLOB', 'Type']].to_dict('index')
 
-# Process and label each image
-for file_name in os.listdir(image_folder):
-    if file_name.endswith('.jpg'):
-        base_id = file_name.split('_')[0]
 
+def load_classification(unique_ids_path, classification_path):
+    """Load the unique IDs and the CSV, then map NACCID to classification info"""
+    # Load the unique IDs from the Excel file
+    unique_ids = load_unique_ids(unique_ids_path)
+
+    # Load the classification data from the CSV file
+    classification_df = load_nacc_metadata(classification_path, columns=('NACCID', 'CDRGLOB'))
+    return map_ids_to_classification(unique_ids, classification_df)
+
+
+def build_label_tasks(image_index, output_base_folder, id_to_classification, output_format=None):
+    """One (label text, [(source, output), ...]) batch per classified patient"""
+    tasks = []
+    for base_id, images in image_index.items():
         if base_id in id_to_classification:
             classification_info = id_to_classification[base_id]
             classification_number = classification_info['CDRGLOB']
             classification_label = classification_info['Type']
 
-            src_path = os.path.join(image_folder, file_name)
-            img = Image.open(src_path)
-
-            draw = ImageDraw.Draw(img)
             text = f"NACCID: {base_id}\nType: {classification_number}\nClassification: {classification_label}"
-            draw.multiline_text((10, 10), text, fill="white", font=font)
-
-            output_path = os.path.join(output_base_folder, file_name)
-            img.save(output_path)
 
-print(f"Labeled images saved to {output_base_folder}")
+            pairs = []
+            for image in images:
+                file_name = os.path.basename(image.path)
+                if output_format:
+                    ext = FORMAT_EXTENSIONS.get(output_format.upper(), os.path.splitext(file_name)[1])
+                    file_name = os.path.splitext(file_name)[0] + ext
+                output_path = os.path.join(output_base_folder, file_name)
+
+                pairs.append((image.path, output_path))
+            tasks.append((text, pairs))
+    return tasks
+
+
+def _init_label_worker(name, size, quality, image_format, draft):
+    global _worker_font, _worker_save_settings
+    _worker_font = load_font(name, size)
+    _worker_save_settings = {'quality': quality, 'image_format': image_format, 'draft': draft}
+
+
+def render_label(text, font):
+    """Rasterize the label block once; returns (top-left corner, coverage mask)"""
+    left, top, right, bottom = ImageDraw.Draw(Image.new('L', (1, 1))).multiline_textbbox(
+        (10, 10), text, font=font)
+    mask = Image.new('L', (max(right, 1), max(bottom, 1)))
+    ImageDraw.Draw(mask).multiline_text((10, 10), text, fill=255, font=font)
+    return (left, top), mask.crop((left, top, right, bottom))
+
+
+def label_image(src_path, output_path, label, quality=None, image_format=None, draft=None):
+    """Composite a pre-rendered label onto one image and save it"""
+    corner, mask = label
+    with Image.open(src_path) as img:
+        if draft and (img.width > draft[0] or img.height > draft[1]):
+            # JPEG only: decode at a reduced scale instead of full resolution
+            img.draft(img.mode, draft)
+        img.load()
+
+        # Same pixels as drawing the text in white, without laying it out again
+        img.paste("white", corner + (corner[0] + mask.width, corner[1] + mask.height), mask)
+
+        save_args = {}
+        if quality is not None:
+            save_args['quality'] = quality
+        img.save(output_path, format=image_format, **save_args)
+
+
+def label_patient(task):
+    """Label every slice of one patient with a single rendering of its label; returns images written"""
+    text, pairs = task
+    label = render_label(text, _worker_font)
+    for src_path, output_path in pairs:
+        label_image(src_path, output_path, label, **_worker_save_settings)
+    return len(pairs)
+
+
+def label_images(tasks, workers=None, chunksize=4):
+    """Label patients across a process pool, loading the font once per worker"""
+    workers = workers or os.cpu_count() or 1
+    # Module settings are read here, not at import, so changes made at runtime apply
+    settings = (font_name, font_size, output_quality, output_format, draft_size)
+    with stage('label', total=len(tasks)) as stats:
+        if workers == 1:
+            _init_label_worker(*settings)
+            for task in tasks:
+                count(stats, items=1, files=label_patient(task))
+            return
+
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_label_worker,
+                                 initargs=settings) as executor:
+            for written in executor.map(label_patient, tasks, chunksize=chunksize):
+                count(stats, items=1, files=written)
+
+
+def main():
+    id_to_classification = load_classification(unique_ids_path, classification_path)
+
+    # Create the base output folder
+    if not os.path.exists(output_base_folder):
+        os.mkdir(output_base_folder)
+
+    # Process and label each image
+    tasks = build_label_tasks(build_image_index(image_folder), output_base_folder,
+                              id_to_classification, output_format)
+    label_images(tasks, workers=workers)
+
+    print(f"Labeled images saved to {output_base_folder}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import os
+import pickle
+import time
+from collections import namedtuple
+
+ImageEntry = namedtuple('ImageEntry', ['path', 'size', 'mtime'])
+
+INDEX_VERSION = 1
+
+# Coarse mtimes (SMB, FAT) can hide a change made in the same tick as the scan
+MTIME_SLACK_NS = 2 * 1_000_000_000
+
+
+def image_naccid(file_name):
+    """NACCID of an image named <NACCID>_<...>.jpg"""
+    return file_name.split('_')[0]
+
+
+def default_index_path(image_folder):
+    """Keep the index next to (not inside) the folder so saving it doesn't touch its mtime"""
+    image_folder = os.path.abspath(image_folder)
+    return os.path.join(os.path.dirname(image_folder), '.nacc_cache',
+                        f"{os.path.basename(image_folder)}_index.pkl")
+
+
+def scan_directory(path, extension):
+    """One scandir pass: matching files as (name, size, mtime) plus subdirectories"""
+    files, subdirs = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+            elif entry.name.endswith(extension):
+                stat = entry.stat()
+                files.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return files, subdirs
+
+
+def restat_files(path, files):
+    """Current (name, size, mtime) of already-listed files, without listing the directory again"""
+    current = []
+    for name, _, _ in files:
+        try:
+            stat = os.stat(os.path.join(path, name))
+        except FileNotFoundError:
+            continue
+        current.append((name, stat.st_size, stat.st_mtime_ns))
+    return current
+
+
+def refresh_index(image_folder, directories=None, extension='.jpg', recursive=False, restat=False):
+    """Rescan only the directories whose mtime changed since the previous scan
+
+    A directory's mtime only changes when files are added, removed or renamed,
+    so a file rewritten in place keeps its old size/mtime in an unchanged
+    directory. With restat=True those files are stat'ed again (one stat per
+    file, no listing); otherwise only the file names are guaranteed current.
+    """
+    previous = directories or {}
+    directories = {}
+    rescanned = 0
+    pending = ['']
+
+    while pending:
+        rel_dir = pending.pop()
+        path = os.path.join(image_folder, rel_dir)
+        mtime = os.stat(path).st_mtime_ns
+        record = previous.get(rel_dir)
+
+        if record is not None and record['mtime'] == mtime and record['scanned'] - mtime > MTIME_SLACK_NS:
+            if restat:
+                files = restat_files(path, record['files'])
+                if files != record['files']:
+                    record = {**record, 'files': files}
+                    rescanned += 1
+            directories[rel_dir] = record
+        else:
+            files, subdirs = scan_directory(path, extension)
+            directories[rel_dir] = {'mtime': mtime, 'scanned': time.time_ns(), 'files': files, 'subdirs': subdirs}
+            rescanned += 1
+
+        if recursive:
+            pending.extend(os.path.join(rel_dir, name) for name in directories[rel_dir]['subdirs'])
+
+    return directories, rescanned
+
+
+def build_image_index(image_folder, extension='.jpg', recursive=False, index_path=None, use_cache=True,
+                      restat=False):
+    """Map NACCID -> [ImageEntry], reusing the on-disk index for unchanged directories
+
+    Entry sizes/mtimes may be stale after in-place rewrites unless restat=True (see refresh_index).
+    """
+    index_path = index_path or default_index_path(image_folder)
+
+    directories = None
+    if use_cache and os.path.exists(index_path):
+        with open(index_path, 'rb') as f:
+            saved = pickle.load(f)
+        if saved.get('version') == INDEX_VERSION and saved.get('options') == (extension, recursive):
+            directories = saved['directories']
+
+    directories, rescanned = refresh_index(image_folder, directories, extension, recursive, restat)
+
+    if use_cache and rescanned:
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'version': INDEX_VERSION, 'options': (extension, recursive),
+                         'directories': directories}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, index_path)
+
+    index = {}
+    for rel_dir, record in directories.items():
+        folder = os.path.join(image_folder, rel_dir) if rel_dir else image_folder
+        for name, size, mtime in record['files']:
+            index.setdefault(image_naccid(name), []).append(
+                ImageEntry(os.path.join(folder, name), size, mtime)
+            )
+    return index
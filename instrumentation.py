@@ -0,0 +1,93 @@
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+COUNTERS = ('items', 'files', 'bytes_read', 'bytes_written', 'errors')
+
+# Where structured events go and how often progress is reported
+_config = {'log_path': None, 'log_file': None, 'interval': 10.0, 'quiet': False}
+_lock = threading.Lock()
+
+
+def configure(log_path=None, interval=10.0, quiet=False):
+    """Send JSON-line events to log_path and print a progress summary every `interval` seconds"""
+    if _config['log_file'] is not None:
+        _config['log_file'].close()
+    _config.update(log_path=log_path, interval=interval, quiet=quiet,
+                   log_file=open(log_path, 'a', buffering=1) if log_path else None)
+
+
+def emit(event, **fields):
+    """Write one structured event as a JSON line"""
+    record = {'ts': round(time.time(), 3), 'event': event, **fields}
+    if _config['log_file'] is not None:
+        with _lock:
+            _config['log_file'].write(json.dumps(record) + "\n")
+    return record
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def snapshot(stats):
+    """Counters plus elapsed time, rates and ETA of a running stage"""
+    elapsed = time.perf_counter() - stats['_start']
+    fields = {'stage': stats['stage'], 'elapsed_s': round(elapsed, 3)}
+    fields.update({name: stats[name] for name in COUNTERS})
+    if elapsed > 0:
+        fields['items_per_s'] = round(stats['items'] / elapsed, 2)
+        fields['mb_written_per_s'] = round(stats['bytes_written'] / elapsed / 1e6, 2)
+    if stats['total']:
+        fields['total'] = stats['total']
+        if stats['items']:
+            fields['eta_s'] = round(elapsed / stats['items'] * (stats['total'] - stats['items']), 1)
+    return fields
+
+
+def _print_progress(fields, done=False):
+    if _config['quiet']:
+        return
+    progress = f"{fields['items']}/{fields['total']}" if 'total' in fields else f"{fields['items']}"
+    line = (f"{'✅' if done else '⏳'} {fields['stage']}: {progress} items, {fields['files']} files, "
+            f"{fields.get('mb_written_per_s', 0)} MB/s written, {fields['errors']} errors, "
+            f"{_format_duration(fields['elapsed_s'])} elapsed")
+    if not done and 'eta_s' in fields:
+        line += f", ETA {_format_duration(fields['eta_s'])}"
+    print(line, file=sys.stderr)
+
+
+def count(stats, **increments):
+    """Add to a stage's counters (thread-safe) and report progress at most once per interval"""
+    with _lock:
+        for name, value in increments.items():
+            stats[name] += value
+        now = time.perf_counter()
+        due = now - stats['_last_report'] >= _config['interval']
+        if due:
+            stats['_last_report'] = now
+    if due:
+        fields = snapshot(stats)
+        emit('progress', **fields)
+        _print_progress(fields)
+
+
+@contextmanager
+def stage(name, total=None):
+    """Time a stage and collect its counters; one summary event when it ends"""
+    now = time.perf_counter()
+    stats = {'stage': name, 'total': total, '_start': now, '_last_report': now}
+    stats.update({counter: 0 for counter in COUNTERS})
+    emit('stage_start', stage=name, total=total)
+    try:
+        yield stats
+    except BaseException as e:
+        emit('stage_failed', error=repr(e), **snapshot(stats))
+        raise
+    fields = snapshot(stats)
+    emit('stage_end', **fields)
+    _print_progress(fields, done=True)
@@ -0,0 +1,212 @@
+import os
+import json
+import hashlib
+import tempfile
+import pandas as pd
+
+try:
+    from openpyxl import load_workbook
+except ImportError:
+    load_workbook = None
+
+try:
+    import pyarrow  # noqa: F401  (enables the Parquet cache)
+    CACHE_FORMAT = "parquet"
+except ImportError:
+    CACHE_FORMAT = "pickle"
+
+# Columns the scripts actually use, with compact dtypes
+NACC_DTYPES = {
+    'NACCID': 'category',
+    'CDRGLOB': 'float32',
+    'VISITYR': 'int16',
+}
+
+HASH_CHUNK = 8 * 1024 * 1024
+
+# Chunked mode: read_csv holds the raw text of every column of a chunk while it
+# parses, so chunks are sized from the CSV's bytes per line, with headroom
+SAMPLE_LINES = 1000
+PARSE_OVERHEAD = 3
+
+
+def file_hash(path):
+    """BLAKE2 hash of a file's content, read in large chunks"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_paths(source_path, cache_dir=None, suffix=''):
+    """Data and sidecar paths of the cached copy of this CSV (or Excel file)"""
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(source_path)), '.nacc_cache')
+    base = os.path.join(cache_dir, os.path.splitext(os.path.basename(source_path))[0] + suffix)
+    return f"{base}.{CACHE_FORMAT}", f"{base}.json"
+
+
+def _column_dtypes(csv_path, columns):
+    header = pd.read_csv(csv_path, nrows=0).columns
+    missing = [c for c in columns if c not in header]
+    if missing:
+        raise ValueError(f"The classification file must contain {', '.join(repr(c) for c in missing)} columns.")
+    return {c: NACC_DTYPES[c] for c in columns if c in NACC_DTYPES}
+
+
+def read_nacc_csv(csv_path, columns=tuple(NACC_DTYPES)):
+    """Read only the requested columns of the NACC CSV with compact dtypes"""
+    dtypes = _column_dtypes(csv_path, columns)
+    return pd.read_csv(csv_path, usecols=list(columns), dtype=dtypes)
+
+
+def chunk_rows(csv_path, memory_budget):
+    """Rows per read_csv chunk so that parsing one chunk stays within memory_budget bytes"""
+    with open(csv_path, 'rb') as f:
+        f.readline()  # header
+        sample = [len(line) for _, line in zip(range(SAMPLE_LINES), f)]
+    line_bytes = sum(sample) / len(sample) if sample else 1
+    return max(1, int(memory_budget / (line_bytes * PARSE_OVERHEAD)))
+
+
+def iter_nacc_csv(csv_path, columns=tuple(NACC_DTYPES), memory_budget=512 * 1024 * 1024):
+    """Stream the requested columns of the NACC CSV in chunks that fit memory_budget bytes"""
+    dtypes = _column_dtypes(csv_path, columns)
+    with pd.read_csv(csv_path, usecols=list(columns), dtype=dtypes,
+                     chunksize=chunk_rows(csv_path, memory_budget)) as reader:
+        yield from reader
+
+
+def partition_nacc_csv(csv_path, key='VISITYR', columns=tuple(NACC_DTYPES),
+                       memory_budget=512 * 1024 * 1024, values=None, spill_dir=None):
+    """Yield (key value, rows) one partition at a time, in key order, without loading the whole CSV
+
+    The CSV is streamed once and every chunk is appended to one spill file per
+    key value, so each partition keeps its rows in CSV order. Only the largest
+    partition has to fit in memory. `values` limits the partitions kept.
+    """
+    dtypes = _column_dtypes(csv_path, columns)
+    with tempfile.TemporaryDirectory(dir=spill_dir, prefix='nacc_partitions_') as tmp_dir:
+        paths = {}
+        for chunk in iter_nacc_csv(csv_path, columns, memory_budget):
+            if values is not None:
+                chunk = chunk[chunk[key].isin(values)]
+            for value, part in chunk.groupby(key, sort=False, observed=True):
+                if value not in paths:
+                    paths[value] = os.path.join(tmp_dir, f"{len(paths)}.csv")
+                    part.to_csv(paths[value], index=False)
+                else:
+                    part.to_csv(paths[value], mode='a', header=False, index=False)
+
+        for value in sorted(paths):
+            yield value, pd.read_csv(paths[value], dtype=dtypes)
+            os.remove(paths[value])
+
+
+def load_nacc_metadata(csv_path, columns=tuple(NACC_DTYPES), cache_dir=None, use_cache=True):
+    """Load the NACC CSV, reusing a cached columnar copy while the source is unchanged"""
+    columns = list(columns)
+    if not use_cache or not set(columns) <= set(NACC_DTYPES):
+        return read_nacc_csv(csv_path, columns)
+    return load_cached_metadata(csv_path, cache_dir)[columns]
+
+
+def load_cached_metadata(csv_path, cache_dir=None):
+    """All NACC_DTYPES columns of the CSV, from the cache when it is still valid"""
+    columns = tuple(NACC_DTYPES)
+    data_path, meta_path = cache_paths(csv_path, cache_dir)
+    if _cache_is_current(csv_path, data_path, meta_path):
+        return _read_cache(data_path)
+
+    # Stat before reading so an edit made during the read invalidates the cache
+    stat = os.stat(csv_path)
+    df = read_nacc_csv(csv_path, columns)
+    _write_cache(df, csv_path, stat, data_path, meta_path)
+    return df
+
+
+def read_excel_ids(excel_path, column='NACCID'):
+    """Stream one column of the first sheet with a read-only workbook; returns the IDs as strings"""
+    if load_workbook is None:
+        raise ImportError("openpyxl is required to read Excel files (pip install openpyxl).")
+
+    workbook = load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        if column not in header:
+            raise ValueError(f"The unique IDs file must contain a column named '{column}'.")
+        position = header.index(column)
+        return [str(row[position]) for row in rows
+                if position < len(row) and row[position] is not None]
+    finally:
+        workbook.close()
+
+
+def load_unique_ids(excel_path, cache_dir=None, use_cache=True):
+    """NACCIDs of uniquePatientData.xlsx as a set, cached like the CSV"""
+    if not use_cache:
+        return set(read_excel_ids(excel_path))
+
+    data_path, meta_path = cache_paths(excel_path, cache_dir, suffix='_ids')
+    if _cache_is_current(excel_path, data_path, meta_path):
+        return set(_read_cache(data_path)['NACCID'])
+
+    stat = os.stat(excel_path)
+    df = pd.DataFrame({'NACCID': read_excel_ids(excel_path)})
+    _write_cache(df, excel_path, stat, data_path, meta_path)
+    return set(df['NACCID'])
+
+
+def _cache_is_current(source_path, data_path, meta_path):
+    """Whether the cached copy still matches the source file"""
+    if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get('format') != CACHE_FORMAT:
+        return False
+
+    stat = os.stat(source_path)
+    if (meta['mtime_ns'], meta['size']) == (stat.st_mtime_ns, stat.st_size):
+        return True
+
+    # Touched or copied but maybe not changed: confirm with the content hash
+    if meta['size'] == stat.st_size and meta['hash'] == file_hash(source_path):
+        meta['mtime_ns'] = stat.st_mtime_ns
+        _write_json(meta_path, meta)
+        return True
+    return False
+
+
+def _write_cache(df, source_path, stat, data_path, meta_path):
+    os.makedirs(os.path.dirname(data_path), exist_ok=True)
+    tmp_path = f"{data_path}.tmp"
+    if CACHE_FORMAT == "parquet":
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_pickle(tmp_path)
+    os.replace(tmp_path, data_path)
+
+    _write_json(meta_path, {
+        'source': os.path.abspath(source_path),
+        'columns': list(df.columns),
+        'format': CACHE_FORMAT,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'hash': file_hash(source_path),
+    })
+    print(f"💾 Cached {len(df)} rows of {source_path} ➜ {data_path}")
+
+
+def _read_cache(data_path):
+    if CACHE_FORMAT == "parquet":
+        return pd.read_parquet(data_path)
+    return pd.read_pickle(data_path)
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
@@ -0,0 +1,238 @@
+import os
+import json
+import argparse
+
+import Extraction
+import uniqueMatching
+import uniqueNACCimage
+import embedText
+import classificationDicom
+import dicomHeaderIndex
+import dicomToJpeg
+import datasetExport
+from naccMetadata import load_nacc_metadata
+from imageIndex import build_image_index
+from filePlacement import PLACEMENT_STRATEGIES
+import instrumentation
+
+DEFAULT_STATE_PATH = os.path.join('.nacc_cache', 'pipeline_state.json')
+
+# Config keys that name files or folders; their fingerprint is size + mtime
+PATH_KEYS = {'main_zip', 'excel', 'csv', 'image_folder', 'dicom_output', 'classified_output'}
+
+
+def path_fingerprint(path):
+    """Cheap change marker for a file or folder: size and mtime, None if missing"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size if os.path.isfile(path) else None, stat.st_mtime_ns]
+
+
+def load_state(state_path):
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_state(state_path, state):
+    os.makedirs(os.path.dirname(state_path) or '.', exist_ok=True)
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, state_path)
+
+
+def get_context(context, key, config):
+    """Load a shared input once and hand the same object to every stage"""
+    if key not in context:
+        if key == 'metadata':
+            context[key] = load_nacc_metadata(config['csv'])
+        elif key == 'unique_ids':
+            context[key] = uniqueNACCimage.load_unique_ids(config['excel'])
+        elif key == 'image_index':
+            context[key] = build_image_index(config['image_folder'])
+        elif key == 'header_index':
+            context[key] = dicomHeaderIndex.load_header_index(config['header_index'])
+        else:
+            raise KeyError(key)
+    return context[key]
+
+
+def run_extract(config, context):
+    os.makedirs(config['dicom_output'], exist_ok=True)
+    Extraction.process_main_zip_streaming(config['main_zip'], config['dicom_output'],
+                                          workers=config['workers'], verify=config['verify'],
+                                          store=config['dedup_store'])
+
+
+def run_headers(config, context):
+    if dicomHeaderIndex.pydicom is None:
+        print("⚠️ Skipping header index: pydicom is not installed")
+        return False
+    index = dicomHeaderIndex.build_header_index(config['dicom_output'], workers=config['workers'])
+    dicomHeaderIndex.save_header_index(index, config['header_index'])
+    context['header_index'] = index
+
+
+def run_convert(config, context):
+    if config['convert_source'] == 'zip':
+        dicomToJpeg.convert_main_zip(config['main_zip'], config['image_folder'], workers=config['workers'])
+    else:
+        dicomToJpeg.convert_folder(config['dicom_output'], config['image_folder'], workers=config['workers'])
+    # The folder changed under any index loaded earlier in this run
+    context.pop('image_index', None)
+
+
+def run_match(config, context):
+    unique_ids = get_context(context, 'unique_ids', config)
+    image_index = get_context(context, 'image_index', config)
+    matching_ids, _ = uniqueMatching.match_ids(unique_ids, set(image_index), config['matches_output'])
+    if config['matches_delta']:
+        uniqueMatching.match_delta(matching_ids, image_index, config['matches_delta'])
+
+
+def run_classify(config, context):
+    id_to_type = uniqueNACCimage.map_ids_to_type(get_context(context, 'unique_ids', config),
+                                                 get_context(context, 'metadata', config))
+    uniqueNACCimage.classify_images(id_to_type, get_context(context, 'image_index', config),
+                                    config['classified_output'], strategy=config['placement'])
+
+
+def run_label(config, context):
+    id_to_classification = embedText.map_ids_to_classification(get_context(context, 'unique_ids', config),
+                                                               get_context(context, 'metadata', config))
+    os.makedirs(config['labeled_output'], exist_ok=True)
+    tasks = embedText.build_label_tasks(get_context(context, 'image_index', config),
+                                        config['labeled_output'], id_to_classification,
+                                        embedText.output_format)
+    embedText.label_images(tasks, workers=config['workers'])
+    print(f"Labeled images saved to {config['labeled_output']}")
+
+
+def run_export(config, context):
+    datasetExport.export_dataset(config['classified_output'], config['export_output'], config['export_format'])
+
+
+def run_summary(config, context):
+    scan_years = None
+    if config['visit_policy'] == 'closest':
+        scan_years = dicomHeaderIndex.scan_years_from_index(get_context(context, 'header_index', config))
+    # With a memory budget the summary streams the CSV instead of using the shared DataFrame
+    df = get_context(context, 'metadata', config) if config['memory_budget'] is None else None
+    classificationDicom.analyze_patient_categories(config['dicom_output'], config['csv'],
+                                                   config['summary_excel'], df=df,
+                                                   policy=config['visit_policy'], scan_years=scan_years,
+                                                   memory_budget=config['memory_budget'])
+
+
+# Stage name -> (function, upstream stages, input config keys, output config keys), in run order.
+# A stage function returns False when it could not produce anything (e.g. an optional dependency is missing).
+STAGES = {
+    'extract': (run_extract, [], ['main_zip', 'verify', 'dedup_store'], ['dicom_output']),
+    'headers': (run_headers, ['extract'], ['dicom_output'], ['header_index']),
+    'convert': (run_convert, ['extract'], ['main_zip', 'dicom_output', 'convert_source'], ['image_folder']),
+    'match': (run_match, ['convert'], ['excel', 'image_folder', 'matches_delta'], ['matches_output']),
+    'classify': (run_classify, ['convert'], ['excel', 'csv', 'image_folder', 'placement'], ['classified_output']),
+    'label': (run_label, ['convert'], ['excel', 'csv', 'image_folder'], ['labeled_output']),
+    'export': (run_export, ['classify'], ['classified_output', 'export_format'], ['export_output']),
+    'summary': (run_summary, ['extract', 'headers'], ['dicom_output', 'csv', 'visit_policy'], ['summary_excel']),
+}
+
+# Stages that only run when asked for with --stages (NACC_jpg may be produced by hand,
+# training shards are only needed before a training run)
+OPTIONAL_STAGES = {'convert', 'export'}
+
+
+def stage_fingerprint(config, input_keys):
+    return {key: path_fingerprint(config[key]) if key in PATH_KEYS else config[key] for key in input_keys}
+
+
+def run_pipeline(config, stages=None, force=False, state_path=DEFAULT_STATE_PATH):
+    """Run the selected stages in one process, skipping those whose inputs are unchanged"""
+    stages = [name for name in STAGES if (name in stages if stages else name not in OPTIONAL_STAGES)]
+    state = load_state(state_path)
+    context = {}
+    ran = set()
+
+    for name in stages:
+        func, upstream, input_keys, output_keys = STAGES[name]
+        fingerprint = stage_fingerprint(config, input_keys)
+        outputs_exist = all(os.path.exists(config[key]) for key in output_keys)
+
+        if (not force and state.get(name) == fingerprint and outputs_exist
+                and not any(stage in ran for stage in upstream)):
+            print(f"⏭️ Skipping {name}: inputs unchanged")
+            instrumentation.emit('stage_skipped', stage=f"pipeline.{name}")
+            continue
+
+        print(f"▶️ Running {name}")
+        with instrumentation.stage(f"pipeline.{name}"):
+            did_run = func(config, context) is not False
+        if not did_run:
+            # Nothing was produced: don't record it, nor make downstream stages rerun
+            continue
+        ran.add(name)
+
+        # Recorded after the run so a stage writing into its own inputs doesn't rerun next time
+        state[name] = stage_fingerprint(config, input_keys)
+        save_state(state_path, state)
+
+    return ran
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the NACC extraction, indexing, matching, classification and labeling stages")
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES),
+                        help="Stages to run (default: all except %s)" % ", ".join(sorted(OPTIONAL_STAGES)))
+    parser.add_argument('--force', action='store_true', help="Run stages even if their inputs are unchanged")
+    parser.add_argument('--state', default=DEFAULT_STATE_PATH, help="Where stage fingerprints are kept")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--log', help="Append structured JSON-line timing/progress events to this file")
+    parser.add_argument('--progress-interval', type=float, default=10.0,
+                        help="Seconds between progress summaries on the console")
+    parser.add_argument('--main-zip', default="DICOM_0417.zip")
+    parser.add_argument('--dicom-output', default="DICOM_cleaned_output")
+    parser.add_argument('--verify', action='store_true',
+                        help="CRC-check extracted members, retry and quarantine corrupt inner zips")
+    parser.add_argument('--dedup-store',
+                        help="Content-addressed folder (same volume as --dicom-output); duplicate members "
+                             "are stored once there and hardlinked")
+    parser.add_argument('--header-index', default="DICOM_cleaned_output_headers.parquet",
+                        help="Columnar DICOM header index (.parquet or .csv)")
+    parser.add_argument('--convert-source', default='folder', choices=['folder', 'zip'],
+                        help="Convert from the extracted folders or straight from the main zip")
+    parser.add_argument('--csv', default='commercial_nacc65a.csv')
+    parser.add_argument('--memory-budget', type=int,
+                        help="Bytes; stream the CSV in chunks within this budget where a stage supports it")
+    parser.add_argument('--excel', default='uniquePatientData.xlsx')
+    parser.add_argument('--image-folder', default='NACC_jpg')
+    parser.add_argument('--matches-output', default='outputMatches.txt')
+    parser.add_argument('--matches-delta', default=uniqueMatching.delta_path,
+                        help="Write matches added/removed/changed since the previous run here ('' to skip)")
+    parser.add_argument('--classified-output', default='uniqueNACCImage')
+    parser.add_argument('--placement', default=uniqueNACCimage.placement_strategy, choices=PLACEMENT_STRATEGIES,
+                        help="copy (default) or opt in to hardlink/symlink, which share files with --image-folder")
+    parser.add_argument('--export-output', default='uniqueNACCShards')
+    parser.add_argument('--export-format', default='tar', choices=datasetExport.EXPORT_FORMATS,
+                        help="WebDataset-style tar shards or mmap-able npy shards with an offsets index")
+    parser.add_argument('--labeled-output', default='labeledNACCImages')
+    parser.add_argument('--summary-excel', default="DICOM_cleaned_output_summary.xlsx",
+                        help="Keep outside --dicom-output, whose fingerprint the headers and summary stages use")
+    parser.add_argument('--visit-policy', default='latest', choices=classificationDicom.VISIT_POLICIES,
+                        help="Which visit's CDRGLOB the summary uses per patient")
+    args = parser.parse_args()
+
+    config = vars(args).copy()
+    stages = config.pop('stages')
+    force = config.pop('force')
+    state_path = config.pop('state')
+    instrumentation.configure(log_path=config.pop('log'), interval=config.pop('progress_interval'))
+
+    run_pipeline(config, stages=stages, force=force, state_path=state_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,9 @@
-import pandas as pd
 import os
+from naccMetadata import load_nacc_metadata, partition_nacc_csv
+from concurrentWriter import make_dirs, write_files
 
 # Load the original CSV file
 csv_path = 'commercial_nacc65a.csv'  # Update this path
-df = pd.read_csv(csv_path)
 
 # Map CDRGLOB values to categories
 alzheimers_category = {
@@ -14,39 +14,51 @@ alzheimers_category = {
     3: 'Severe'
 }
 
-# Add a column with mapped categories
-df['AlzheimerClassification'] = df['CDRGLOB'].map(alzheimers_category)
-
 # Define the base output directory
 output_base_dir = 'typeClassified'  # Update this path
+years = [2021, 2022, 2023]  # Years to export, or None for every year in the CSV
+write_in_flight = 64  # Concurrent folder creates and file writes
+memory_budget = None  # e.g. 512 * 1024 * 1024 to stream the CSV one year at a time within that many bytes
 if not os.path.exists(output_base_dir):
     os.mkdir(output_base_dir)
 
-# Filter the data for years 2021, 2022, and 2023
-df_filtered_years = df[df['VISITYR'].isin([2021, 2022, 2023])]
-
-# Group by year and Alzheimer classification
-for year, year_group in df_filtered_years.groupby('VISITYR'):
-    # Create a folder for the year
-    year_folder = os.path.join(output_base_dir, str(year))
-    if not os.path.exists(year_folder):
-        os.mkdir(year_folder)
-
-    # Create subfolders for each Alzheimer’s category (No Alzheimers, Mild, etc.)
-    for category_code, category_name in alzheimers_category.items():
-        category_folder = os.path.join(year_folder, category_name)
-        if not os.path.exists(category_folder):
-            os.mkdir(category_folder)
-
-        # Filter patients for this category and year
-        category_patients = year_group[year_group['CDRGLOB'] == category_code]
-
-        # Save patient IDs to the corresponding category folder
-        for _, row in category_patients.iterrows():
-            patient_id = row['NACCID']
-            # Create a file for each patient ID if it doesn't exist
-            patient_file_path = os.path.join(category_folder, f"{patient_id}.txt")
-            with open(patient_file_path, 'a') as file:
-                file.write(f"Patient ID: {patient_id}\n")
+
+def write_patient_files(df_filtered_years):
+    """Category folders and one file per patient for the given years' visits"""
+    # Add a column with mapped categories
+    df_filtered_years = df_filtered_years.assign(
+        AlzheimerClassification=df_filtered_years['CDRGLOB'].map(alzheimers_category))
+
+    # Create a folder per year with subfolders for each Alzheimer’s category (No Alzheimers, Mild, etc.)
+    make_dirs((os.path.join(output_base_dir, str(year), category_name)
+               for year in sorted(df_filtered_years['VISITYR'].unique())
+               for category_name in alzheimers_category.values()), in_flight=write_in_flight)
+
+    # Only rows with a known category get a patient file
+    df_filtered = df_filtered_years[df_filtered_years['AlzheimerClassification'].notna()]
+
+    # Single pass: one row per (year, category, patient) with its number of visits
+    patient_visits = (
+        df_filtered.groupby(['VISITYR', 'AlzheimerClassification', 'NACCID'], observed=True)
+        .size()
+        .reset_index(name='Visits')
+    )
+
+    # Write each patient file exactly once, one line per visit, so reruns don't append duplicates
+    write_files(((os.path.join(output_base_dir, str(year), category_name, f"{patient_id}.txt"),
+                  f"Patient ID: {patient_id}\n" * visits)
+                 for year, category_name, patient_id, visits in patient_visits.itertuples(index=False)),
+                in_flight=write_in_flight)
+
+
+if memory_budget is None:
+    df = load_nacc_metadata(csv_path)
+
+    # Filter the data for the selected years
+    write_patient_files(df if years is None else df[df['VISITYR'].isin(years)])
+else:
+    # Patient files never span years, so each selected year is handled on its own
+    for year, year_df in partition_nacc_csv(csv_path, key='VISITYR', memory_budget=memory_budget, values=years):
+        write_patient_files(year_df)
 
 print(f"Patient data has been written to {output_base_dir}")
@@ -1,17 +1,10 @@
-import os
+from imageIndex import build_image_index
 
 # Specify the path to the folder containing the images
 image_folder = 'NACC_jpg'  # Update this path
 
-# Initialize a set to store unique IDs
-unique_ids = set()
-
-# Iterate through the files in the folder
-for file_name in os.listdir(image_folder):
-    if file_name.endswith('.jpg'):  # Process only .jpg files
-        # Extract the part of the filename before the first underscore
-        id_part = file_name.split('_')[0]  # Get the part before the first underscore
-        unique_ids.add(id_part)
+# The shared folder index maps each ID (the part before the first underscore) to its .jpg files
+unique_ids = set(build_image_index(image_folder))
 
 # Count the total number of unique IDs
 num_unique_ids = len(unique_ids)
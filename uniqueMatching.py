@@ -1,40 +1,124 @@
 import os
-import pandas as pd
+import json
+from naccMetadata import load_unique_ids
+from imageIndex import build_image_index
 
 # Specify the paths
 image_folder = 'NACC_jpg'  # Update this path
 excel_path = 'uniquePatientData.xlsx'  # Update this path
+output_path = 'outputMatches.txt'  # Update this path
+delta_path = 'outputMatchesDelta.txt'  # Added/removed/changed matches since the last run (None to skip)
 
-# Load unique IDs from the Excel file
-df = pd.read_excel(excel_path)
-excel_ids = set(df['NACCID'].astype(str))  # Assuming the column is named 'NACCID'
 
-# Initialize a set to store IDs found in the image folder
-image_ids = set()
+def load_excel_ids(excel_path):
+    """Load unique IDs from the Excel file"""
+    return load_unique_ids(excel_path)  # Only the 'NACCID' column is read
 
-# Iterate through the files in the image folder
-for file_name in os.listdir(image_folder):
-    if file_name.endswith('.jpg'):  # Process only .jpg files
-        # Extract the part of the filename before the first underscore
-        base_id = file_name.split('_')[0]  # Get the base ID
-        image_ids.add(base_id)
 
-# Find matches and non-matches
-matching_ids = excel_ids.intersection(image_ids)
-non_matching_ids = excel_ids.difference(image_ids)
+def match_ids(excel_ids, image_ids, output_path):
+    """Find matches and non-matches and save them to a text file"""
+    matching_ids = excel_ids.intersection(image_ids)
+    non_matching_ids = excel_ids.difference(image_ids)
 
-# Output the results
-print(f"Total IDs in Excel: {len(excel_ids)}")
-print(f"Total IDs in Image Folder: {len(image_ids)}")
-print(f"Matching IDs: {len(matching_ids)}")
-print(f"Non-Matching IDs: {len(non_matching_ids)}")
+    # Output the results
+    print(f"Total IDs in Excel: {len(excel_ids)}")
+    print(f"Total IDs in Image Folder: {len(image_ids)}")
+    print(f"Matching IDs: {len(matching_ids)}")
+    print(f"Non-Matching IDs: {len(non_matching_ids)}")
+
+    # Save the results to a text file, sorted so runs can be compared line by line
+    with open(output_path, 'w') as file:
+        file.write("Matching IDs:\n")
+        file.write("\n".join(sorted(matching_ids)) + "\n\n")
+        file.write("Non-Matching IDs:\n")
+        file.write("\n".join(sorted(non_matching_ids)) + "\n")
+
+    print(f"Results saved to {output_path}")
+    return matching_ids, non_matching_ids
+
+
+def default_snapshot_path(output_path):
+    """Where the previous run's matches are kept, next to the output file"""
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    stem = os.path.splitext(os.path.basename(output_path))[0]
+    return os.path.join(output_dir, '.nacc_cache', f"{stem}_snapshot.json")
+
+
+def match_signatures(matching_ids, image_index):
+    """Per matched NACCID: image count, total bytes and newest mtime of its images
+
+    The files are stat'ed here rather than trusting the index, whose sizes and
+    mtimes go stale when an image is rewritten in place.
+    """
+    signatures = {}
+    for nacc_id in matching_ids:
+        stats = []
+        for image in image_index[nacc_id]:
+            try:
+                stats.append(os.stat(image.path))
+            except FileNotFoundError:
+                continue
+        signatures[nacc_id] = [len(stats),
+                               sum(stat.st_size for stat in stats),
+                               max((stat.st_mtime_ns for stat in stats), default=0)]
+    return signatures
+
+
+def load_snapshot(snapshot_path):
+    if not os.path.exists(snapshot_path):
+        return {}
+    with open(snapshot_path) as f:
+        return json.load(f)['matches']
+
+
+def save_snapshot(snapshot_path, signatures):
+    os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+    tmp_path = f"{snapshot_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'matches': signatures}, f, sort_keys=True)
+    os.replace(tmp_path, snapshot_path)
+
+
+def match_delta(matching_ids, image_index, delta_path, snapshot_path=None):
+    """Write only the matches added, removed or changed since the previous run
+
+    A match counts as changed when its images differ in count, total size or
+    newest mtime. The snapshot is updated afterwards; on the first run every
+    match is reported as added.
+    """
+    snapshot_path = snapshot_path or default_snapshot_path(delta_path)
+    previous = load_snapshot(snapshot_path)
+    current = match_signatures(matching_ids, image_index)
+
+    added = sorted(current.keys() - previous.keys())
+    removed = sorted(previous.keys() - current.keys())
+    changed = sorted(nacc_id for nacc_id in current.keys() & previous.keys()
+                     if current[nacc_id] != previous[nacc_id])
+
+    print(f"Added matches: {len(added)}")
+    print(f"Removed matches: {len(removed)}")
+    print(f"Changed matches: {len(changed)}")
+
+    with open(delta_path, 'w') as file:
+        for title, ids in (("Added", added), ("Removed", removed), ("Changed", changed)):
+            file.write(f"{title} matches:\n")
+            file.write("".join(f"{nacc_id}\n" for nacc_id in ids) + "\n")
+
+    save_snapshot(snapshot_path, current)
+    print(f"Delta saved to {delta_path}")
+    return added, removed, changed
+
+
+def main():
+    excel_ids = load_excel_ids(excel_path)
+
+    # IDs found in the image folder, from the shared folder index
+    image_index = build_image_index(image_folder)
+
+    matching_ids, _ = match_ids(excel_ids, set(image_index), output_path)
+    if delta_path:
+        match_delta(matching_ids, image_index, delta_path)
 
-# Save the results to a text file
-output_path = 'outputMatches.txt'  # Update this path
-with open(output_path, 'w') as file:
-    file.write("Matching IDs:\n")
-    file.write("\n".join(matching_ids) + "\n\n")
-    file.write("Non-Matching IDs:\n")
-    file.write("\n".join(non_matching_ids) + "\n")
 
-print(f"Results saved to {output_path}")
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,16 @@
 import os
-import shutil
-import pandas as pd
+from naccMetadata import load_nacc_metadata, load_unique_ids
+from filePlacement import place_files
+from concurrentWriter import make_dirs, write_files
+from imageIndex import build_image_index
 
 # Specify file paths
 unique_ids_path = 'uniquePatientData.xlsx'  # Path to the Excel file with unique IDs
 classification_path = 'commercial_nacc65a.csv'  # Path to the CSV file with CDRGLOB classifications
 image_folder = 'NACC_jpg'  # Path to the folder containing the images
 output_base_folder = 'uniqueNACCImage'  # Base folder for classified images
-
-# Load the unique IDs from the Excel file
-unique_ids_df = pd.read_excel(unique_ids_path)
-if 'NACCID' not in unique_ids_df.columns:
-    raise ValueError("The unique IDs file must contain a column named 'NACCID'.")
-
-unique_ids = set(unique_ids_df['NACCID'].astype(str))  # Convert to string and store in a set
-
-# Load the classification data from the CSV file
-classification_df = pd.read_csv(classification_path)
-if 'NACCID' not in classification_df.columns or 'CDRGLOB' not in classification_df.columns:
-    raise ValueError("The classification file must contain 'NACCID' and 'CDRGLOB' columns.")
+placement_strategy = 'copy'  # Or opt in to 'hardlink'/'symlink' (share files with image_folder), 'reflink', 'kernel_copy'
+placement_workers = 64  # Image placements kept in flight at once
 
 # Map CDRGLOB to readable categories
 alzheimers_category = {
@@ -29,56 +21,69 @@ alzheimers_category = {
     3: 'Severe'
 }
 
-# Add a column with mapped categories
-classification_df['Type'] = classification_df['CDRGLOB'].map(alzheimers_category)
 
-# Filter the classification data for only the unique IDs
-classification_filtered = classification_df[classification_df['NACCID'].astype(str).isin(unique_ids)]
+def map_ids_to_type(unique_ids, classification_df):
+    """Map each unique NACCID to its readable classification type"""
+    # Add a column with mapped categories
+    classification_df = classification_df.assign(Type=classification_df['CDRGLOB'].map(alzheimers_category))
 
-# Create a dictionary to map NACCID to classification type
-id_to_type = classification_filtered.set_index('NACCID')['Type'].to_dict()
+    # Filter the classification data for only the unique IDs
+    classification_filtered = classification_df[classification_df['NACCID'].astype(str).isin(unique_ids)]
 
-# Create the base output folder
-if not os.path.exists(output_base_folder):
-    os.mkdir(output_base_folder)
+    # Create a dictionary to map NACCID to classification type
+    return classification_filtered.set_index('NACCID')['Type'].to_dict()
 
-# Create type subfolders
-types = set(id_to_type.values())  # Get all unique types
-type_folders = {}
-for t in types:
-    type_folder = os.path.join(output_base_folder, f'type_{t}')
-    if not os.path.exists(type_folder):
-        os.mkdir(type_folder)
-    type_folders[t] = type_folder
 
-# Initialize a dictionary to count the number of images in each type folder
-type_image_counts = {t: 0 for t in types}
+def classify_images(id_to_type, image_index, output_base_folder,
+                    strategy=placement_strategy, workers=placement_workers):
+    """Place every image of a classified patient into its type_* folder"""
+    # Create the base output folder and the type subfolders
+    types = set(id_to_type.values())  # Get all unique types
+    type_folders = {t: os.path.join(output_base_folder, f'type_{t}') for t in types}
+    make_dirs([output_base_folder, *type_folders.values()])
 
-# Classify the images
-for file_name in os.listdir(image_folder):
-    if file_name.endswith('.jpg'):  # Process only .jpg files
-        # Extract the base ID before the first underscore
-        base_id = file_name.split('_')[0]
+    # Initialize a dictionary to count the number of images in each type folder
+    type_image_counts = {t: 0 for t in types}
 
+    # Classify the images
+    placements = []
+    for base_id, images in image_index.items():
         # Check if the base ID exists in the classification data
         if base_id in id_to_type:
             image_type = id_to_type[base_id]  # Get the corresponding type
             target_folder = type_folders[image_type]  # Get the corresponding folder
 
-            # Copy the image to the target folder
-            src_path = os.path.join(image_folder, file_name)
-            dst_path = os.path.join(target_folder, file_name)
-            shutil.copy(src_path, dst_path)
+            # Queue the images for the target folder
+            for image in images:
+                dst_path = os.path.join(target_folder, os.path.basename(image.path))
+                placements.append((image.path, dst_path))
 
             # Increment the image count for the type folder
-            type_image_counts[image_type] += 1
+            type_image_counts[image_type] += len(images)
+
+    # Place the images (links are near-instant and use no extra space, but share the source files)
+    used_strategies = place_files(placements, strategy=strategy, workers=workers)
+    if strategy != 'copy' and 'copy' in used_strategies:
+        print(f"⚠️ {used_strategies.count('copy')} images were copied because '{strategy}' is not supported there")
+
+    # Write the summary file for each folder
+    write_files((os.path.join(type_folders[image_type], 'folder_summary.txt'),
+                 f"Folder Name: type_{image_type}\nTotal Images: {count}\n")
+                for image_type, count in type_image_counts.items())
+
+    print(f"Images classified into subfolders under {output_base_folder}")
+    return type_image_counts
+
+
+def main():
+    unique_ids = load_unique_ids(unique_ids_path)
+
+    # Load the classification data from the CSV file
+    classification_df = load_nacc_metadata(classification_path, columns=('NACCID', 'CDRGLOB'))
+
+    id_to_type = map_ids_to_type(unique_ids, classification_df)
+    classify_images(id_to_type, build_image_index(image_folder), output_base_folder)
 
-# Write the summary file for each folder
-for image_type, count in type_image_counts.items():
-    type_folder = type_folders[image_type]
-    summary_file = os.path.join(type_folder, 'folder_summary.txt')
-    with open(summary_file, 'w') as file:
-        file.write(f"Folder Name: type_{image_type}\n")
-        file.write(f"Total Images: {count}\n")
 
-print(f"Images classified into subfolders under {output_base_folder}")
+if __name__ == "__main__":
+    main()